@@ -0,0 +1,76 @@
+import sys
+import time
+
+
+# Modules that are expensive to import and should only be loaded once they are needed
+HEAVY_MODULES = [
+    "PySide6.QtMultimedia",
+    "PySide6.QtMultimediaWidgets",
+    "cv2",
+    "numpy",
+    "yaml",
+    "pytube",
+    "requests",
+]
+
+
+class StartupTimer(object):
+    """
+    Records named timestamps relative to the moment it was created.  Create it before any other
+    import so that the first mark covers everything the entry point pulls in.
+
+    Each mark also records which of HEAVY_MODULES were first seen loaded at that point.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self._seen_modules = set()
+
+    def mark(self, name: str) -> float:
+        elapsed = time.perf_counter() - self.start
+        loaded = [m for m in HEAVY_MODULES if m in sys.modules and m not in self._seen_modules]
+        self._seen_modules.update(loaded)
+        self.marks.append((name, elapsed, loaded))
+        return elapsed
+
+    def report(self) -> str:
+        lines = ["startup timings:"]
+        previous = 0.0
+        for name, elapsed, loaded in self.marks:
+            line = (
+                f"    {name:<20}{elapsed * 1000:8.1f} ms  (+{(elapsed - previous) * 1000:.1f} ms)"
+            )
+            if loaded:
+                line += f"  loaded: {', '.join(loaded)}"
+            lines.append(line)
+            previous = elapsed
+        return "\n".join(lines)
+
+
+class IdleCpuMeter(object):
+    """
+    CPU time used by the whole process (every thread, including Qt's and the task scheduler's)
+    between start() and stop(), as a share of one core.  Measured while the application sits
+    idle, anything above zero is work done for nothing: timers firing, polling, repainting.
+    """
+
+    def __init__(self):
+        self.wall_start = None
+        self.cpu_start = None
+        self.usage = None
+
+    def start(self) -> None:
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def stop(self) -> float:
+        cpu = time.process_time() - self.cpu_start
+        wall = time.perf_counter() - self.wall_start
+        self.usage = cpu / wall
+        return self.usage
+
+    def report(self) -> str:
+        if self.usage is None:
+            return "idle CPU: not measured"
+        return f"idle CPU: {self.usage * 100:.2f}% of a core"
@@ -0,0 +1,271 @@
+import glob
+import io
+import mmap
+import os
+import re
+import tarfile
+import time
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+# (class id, x center, y center, width, height), all but the class id normalized to 0..1
+YoloBox = Tuple[int, float, float, float, float]
+
+
+def format_yolo_labels(boxes: List[YoloBox]) -> str:
+    return "".join(f"{label_id} {x} {y} {w} {h}\n" for label_id, x, y, w, h in boxes)
+
+
+def write_yolo_labels(fname: str, boxes: List[YoloBox]) -> None:
+    with open(fname, "w") as f:
+        f.write(format_yolo_labels(boxes))
+
+
+def write_sample(output_folder: str, stem: str, image, boxes: List[YoloBox]) -> None:
+    """Write `image` (a BGR array as returned by OpenCV) and its labels as <stem>.png/.txt."""
+    import cv2
+
+    fname = f"{output_folder}/{stem}"
+    if image is not None:
+        cv2.imwrite(fname + ".png", image)
+    write_yolo_labels(fname + ".txt", boxes)
+
+
+class FolderWriter(object):
+    """Writes each sample as <stem>.png and <stem>.txt in the output folder."""
+
+    def __init__(self, output_folder: str):
+        self.output_folder = output_folder
+
+    def write(self, stem: str, image, boxes: List[YoloBox]) -> None:
+        write_sample(self.output_folder, stem, image, boxes)
+
+    def is_up_to_date(self, stem: str, boxes: List[YoloBox]) -> bool:
+        fname = os.path.join(self.output_folder, stem)
+        if not (os.path.exists(fname + ".png") and os.path.exists(fname + ".txt")):
+            return False
+        with open(fname + ".txt", "r") as f:
+            return f.read() == format_yolo_labels(boxes)
+
+    def close(self) -> None:
+        pass
+
+
+# stem -> (shard file, png offset, png size, txt offset, txt size, sequence).  Offsets are of the
+# member data within the tar file; a sample without an image has a png size of 0.  The sequence is
+# the time the sample was written, in ns: of several copies of a stem, the latest one counts.
+ShardIndex = Dict[str, Tuple[str, int, int, int, int, int]]
+
+
+def padded_size(size: int) -> int:
+    """The space tar member data of `size` bytes takes up, padded to whole blocks."""
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def read_shard_index(idx_fname: str) -> ShardIndex:
+    tar_fname = idx_fname[: -len(".idx")] + ".tar"
+    index = {}
+    with open(idx_fname, "r") as f:
+        for line in f:
+            # A line cut short by a crash is ignored, its sample was not completely written
+            if not line.endswith("\n"):
+                continue
+            fields = line[:-1].split("\t")
+            if len(fields) == 5:
+                # Written before sequences were recorded
+                fields.append("0")
+            if len(fields) != 6:
+                continue
+            stem, *numbers = fields
+            index[stem] = (tar_fname, *(int(number) for number in numbers))
+    return index
+
+
+class ShardWriter(object):
+    """
+    Packs samples into uncompressed tar shards of roughly `max_shard_bytes`, named
+    <prefix>-000000.tar, <prefix>-000001.tar, ... so that training data loaders read a few large
+    files instead of one small file per image and label.
+
+    Every shard has a sidecar <shard>.idx text file with one line per sample:
+    `stem<TAB>png offset<TAB>png size<TAB>txt offset<TAB>txt size<TAB>sequence`, so a sample can
+    be read by slicing the memory-mapped shard (see ShardReader) without scanning the tar headers.
+    Index lines are only written once the sample is in the shard.
+
+    Opening a writer on a folder that already has shards with the same prefix appends to the last
+    one until it is full, starting right after its last indexed sample.  Whatever a writer that
+    did not exit cleanly left after that (a partial sample, a missing end-of-archive marker) is
+    overwritten.  Only one writer at a time may use a prefix.
+
+    write() is thread-safe; PNG encoding happens outside the lock.  Writing the same stem again
+    adds a new copy with a later sequence, which takes precedence over the old one in any shard.
+    """
+
+    def __init__(
+        self, output_folder: str, prefix: str = "shard", max_shard_bytes: int = 256 * 1024 * 1024
+    ):
+        self.output_folder = output_folder
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self._lock = Lock()
+        self._tar = None
+        self._tar_file = None
+        self._index_file = None
+
+        # Everything already written to the folder, by any writer, for is_up_to_date()
+        self.existing = ShardReader(output_folder)
+
+        # Only this prefix's own series: "shard-*" would also match e.g. "shard-export-00-*"
+        pattern = re.compile(rf"{re.escape(prefix)}-\d{{6}}\.tar")
+        shard_fnames = sorted(
+            fname
+            for fname in glob.glob(os.path.join(output_folder, f"{glob.escape(prefix)}-*.tar"))
+            if pattern.fullmatch(os.path.basename(fname))
+        )
+        if shard_fnames and os.path.getsize(shard_fnames[-1]) < max_shard_bytes:
+            self.shard_number = len(shard_fnames) - 1
+        else:
+            self.shard_number = len(shard_fnames)
+
+    def _shard_fname(self, extension: str) -> str:
+        return os.path.join(self.output_folder, f"{self.prefix}-{self.shard_number:06d}{extension}")
+
+    def _open_shard(self) -> None:
+        tar_fname = self._shard_fname(".tar")
+        idx_fname = self._shard_fname(".idx")
+
+        end = 0
+        if os.path.exists(idx_fname):
+            with open(idx_fname, "r") as f:
+                lines = f.readlines()
+            if lines and not lines[-1].endswith("\n"):
+                # Cut short by a crash, the next line would be appended to it
+                with open(idx_fname, "w") as f:
+                    f.writelines(lines[:-1])
+            for sample in read_shard_index(idx_fname).values():
+                end = max(end, sample[3] + padded_size(sample[4]))
+
+        # tarfile's append mode needs an intact end-of-archive marker, which is only written on
+        # close, so the shard is instead continued as a new archive from the end of its last
+        # indexed sample
+        self._tar_file = open(tar_fname, "r+b" if os.path.exists(tar_fname) else "w+b")
+        self._tar_file.truncate(end)
+        self._tar_file.seek(end)
+        self._tar = tarfile.open(fileobj=self._tar_file, mode="w")
+        self._index_file = open(idx_fname, "a")
+
+    def _close_shard(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._tar_file.close()
+            self._index_file.close()
+            self._tar = None
+            self._tar_file = None
+            self._index_file = None
+
+    def _add_member(self, name: str, data: bytes) -> Tuple[int, int]:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+
+        # The data follows the header block(s) and is padded to whole blocks
+        self._tar.addfile(info, io.BytesIO(data))
+        return self._tar.offset - padded_size(info.size), info.size
+
+    def write(self, stem: str, image, boxes: List[YoloBox]) -> None:
+        png = b""
+        if image is not None:
+            import cv2
+
+            success, encoded = cv2.imencode(".png", image)
+            if success:
+                png = encoded.tobytes()
+        txt = format_yolo_labels(boxes).encode()
+
+        with self._lock:
+            if self._tar is None:
+                self._open_shard()
+
+            png_offset, png_size = self._add_member(stem + ".png", png) if png else (0, 0)
+            txt_offset, txt_size = self._add_member(stem + ".txt", txt)
+            self._tar.fileobj.flush()
+            self._index_file.write(
+                f"{stem}\t{png_offset}\t{png_size}\t{txt_offset}\t{txt_size}\t{time.time_ns()}\n"
+            )
+            self._index_file.flush()
+
+            if self._tar.offset >= self.max_shard_bytes:
+                self._close_shard()
+                self.shard_number += 1
+
+    def is_up_to_date(self, stem: str, boxes: List[YoloBox]) -> bool:
+        sample = self.existing.index.get(stem)
+        if sample is None or sample[2] == 0:
+            return False
+        return self.existing.read_labels(stem) == format_yolo_labels(boxes)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_shard()
+            self.existing.close()
+
+
+class ShardReader(object):
+    """
+    Random access to the samples of all shards in a folder, through their sidecar indexes.  Where
+    a stem was written more than once, the latest copy is read.
+    """
+
+    def __init__(self, folder: str):
+        self.index: ShardIndex = {}
+        for idx_fname in sorted(glob.glob(os.path.join(folder, "*.idx"))):
+            for stem, sample in read_shard_index(idx_fname).items():
+                if stem not in self.index or sample[5] >= self.index[stem][5]:
+                    self.index[stem] = sample
+        self._maps = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def stems(self) -> List[str]:
+        return list(self.index)
+
+    def _map(self, tar_fname: str) -> mmap.mmap:
+        if tar_fname not in self._maps:
+            with open(tar_fname, "rb") as f:
+                self._maps[tar_fname] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[tar_fname]
+
+    def read(self, stem: str) -> Tuple[Optional[bytes], str]:
+        """The PNG data (None if the frame could not be read) and label text of a sample."""
+        tar_fname, png_offset, png_size, txt_offset, txt_size, _ = self.index[stem]
+        data = self._map(tar_fname)
+        png = data[png_offset : png_offset + png_size] if png_size else None
+        return png, data[txt_offset : txt_offset + txt_size].decode()
+
+    def read_labels(self, stem: str) -> str:
+        # A few bytes, read without mapping the shard: a writer appending to the shard must be able
+        # to truncate it, which Windows refuses while the file is mapped
+        tar_fname, _, _, txt_offset, txt_size, _ = self.index[stem]
+        with open(tar_fname, "rb") as f:
+            f.seek(txt_offset)
+            return f.read(txt_size).decode()
+
+    def close(self) -> None:
+        for data in self._maps.values():
+            data.close()
+        self._maps = {}
+
+
+OUTPUT_WRITERS = {"files": FolderWriter, "shards": ShardWriter}
+
+
+def load_label_names(fname: str) -> List[str]:
+    """The `names` list of a YOLO dataset YAML file, or an empty list if it has none."""
+    import yaml
+
+    with open(fname, "r") as f:
+        custom_data = yaml.safe_load(f)
+    if custom_data is not None and "names" in custom_data:
+        return list(custom_data["names"])
+    return []
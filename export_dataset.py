@@ -0,0 +1,181 @@
+"""
+Exports frames and YOLO labels for saved annotation sessions, without the GUI.
+
+    python export_dataset.py --names data.yaml --output dataset/ [sessions ...]
+
+Sessions are the JSON files the video player saves under <output folder>/sessions when frames
+are marked.  Videos are exported in parallel across processes, each in a single decoding pass.
+Frames whose image exists and whose label file already has the expected contents are skipped, so
+re-running only exports what was added or changed (including label renumbering in the YAML file).
+
+With --format shards, samples are packed into indexed tar shards instead of one .png and .txt
+per frame (see dataset.ShardWriter).  Each worker process fills a series of its own,
+export-<worker>-000000.tar, ..., which later runs continue.  Do not run two exports into the same
+folder at once.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+from typing import List
+
+from dataset import OUTPUT_WRITERS, ShardWriter, load_label_names
+from exporter import export_marks
+from sessions import SESSIONS_FOLDER, AnnotationSession
+from streams import ResolutionPolicy
+
+
+# The output writer of the current worker process, see init_worker()
+writer = None
+
+
+def init_worker(output_folder: str, output_format: str, worker_numbers):
+    global writer
+
+    if output_format == "shards":
+        # Processes cannot share a shard, so every worker writes a series of its own.  Numbering
+        # the series by worker rather than by process means each run appends to the previous
+        # run's shards instead of starting new, partly filled ones.
+        writer = ShardWriter(output_folder, prefix=f"export-{worker_numbers.get():02d}")
+    else:
+        writer = OUTPUT_WRITERS[output_format](output_folder)
+    # Closes the last shard properly when the pool shuts the worker down
+    Finalize(writer, writer.close, exitpriority=10)
+
+
+def resolve_source(source: str, max_height: int) -> str:
+    if os.path.exists(source):
+        return source
+
+    from pytube import YouTube
+
+    stream = ResolutionPolicy(export_max_height=max_height).export_stream(YouTube(source).streams)
+    if stream is None:
+        raise ValueError(f"no video stream available for {source}")
+    return stream.url
+
+
+def export_session(
+    session_fname: str,
+    names: List[str],
+    max_height: int,
+    encoders: int,
+    force: bool,
+):
+    """Runs in a worker process.  Returns (video id, frames written, frames up to date)."""
+    session = AnnotationSession.load(session_fname)
+    marks = session.marks_for(names)
+
+    total = len(marks)
+    if not force:
+        marks = [
+            mark
+            for mark in marks
+            if not writer.is_up_to_date(mark.stem(session.video_id), mark.boxes)
+        ]
+
+    written = 0
+    if marks:
+        source = resolve_source(session.source, max_height)
+        written = export_marks(source, marks, writer, session.video_id, encoders)
+    return session.video_id, written, total - len(marks)
+
+
+def find_sessions(paths: List[str]) -> List[str]:
+    session_fnames = []
+    for path in paths:
+        if os.path.isdir(path):
+            session_fnames.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            session_fnames.append(path)
+    return session_fnames
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "sessions",
+        nargs="*",
+        help=f"session files or folders of them (default: <output>/{SESSIONS_FOLDER})",
+    )
+    parser.add_argument("--names", required=True, help="YAML file with the `names` list")
+    parser.add_argument("--output", required=True, help="folder to write frames and labels to")
+    parser.add_argument(
+        "--format",
+        choices=sorted(OUTPUT_WRITERS),
+        default="files",
+        help="one .png and .txt per frame, or indexed tar shards",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="videos exported in parallel"
+    )
+    parser.add_argument("--encoders", type=int, default=2, help="PNG encoder threads per video")
+    parser.add_argument(
+        "--max-height", type=int, default=1080, help="highest resolution to export at"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="export every frame, even if up to date"
+    )
+    return parser.parse_args(argv[1:])
+
+
+def main(argv) -> int:
+    args = parse_args(argv)
+
+    names = load_label_names(args.names)
+    if not names:
+        print(f"{args.names} has no `names` list")
+        return 1
+
+    session_fnames = find_sessions(args.sessions or [os.path.join(args.output, SESSIONS_FOLDER)])
+    if not session_fnames:
+        print("no sessions to export")
+        return 0
+
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    failed = 0
+    total_written = 0
+    worker_numbers = multiprocessing.Queue()
+    for i in range(args.jobs):
+        worker_numbers.put(i)
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=init_worker,
+        initargs=(args.output, args.format, worker_numbers),
+    ) as pool:
+        futures = {
+            pool.submit(
+                export_session,
+                fname,
+                names,
+                args.max_height,
+                args.encoders,
+                args.force,
+            ): fname
+            for fname in session_fnames
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            try:
+                video_id, written, up_to_date = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{i}/{len(futures)}] {futures[future]}: failed: {e}")
+                continue
+            total_written += written
+            print(f"[{i}/{len(futures)}] {video_id}: {written} written, {up_to_date} up to date")
+
+    print(
+        f"{total_written} frames written from {len(session_fnames) - failed} videos "
+        f"in {time.perf_counter() - start:.1f} s, {failed} failed"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,110 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from dataset import YoloBox
+
+
+class Mark(object):
+    """A frame to export: its position in the video and the boxes drawn on it."""
+
+    def __init__(self, position_ms: int, boxes: List[YoloBox]):
+        self.position_ms = position_ms
+        self.boxes = boxes
+
+    def stem(self, video_id: str) -> str:
+        # Same naming as frames saved one at a time from the video player
+        return f"{video_id}_{self.position_ms}"
+
+
+def export_marks(
+    source: str,
+    marks: List[Mark],
+    writer,
+    video_id: str,
+    max_workers: int = 4,
+    token=None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    Export every marked frame of one video in a single forward decoding pass.
+
+    Seeking once per frame costs a decode from the preceding keyframe every time, which dominates
+    with long GOPs.  Instead the marks are sorted, the video is positioned at the first one and
+    read forward: frames nobody marked are only grab()bed, marked ones are retrieve()d and handed
+    to a pool of encoders while decoding continues.  `writer` is one of dataset.OUTPUT_WRITERS.
+
+    A mark selects the frame being displayed at its position, i.e. the last frame starting at or
+    before it.  Returns the number of frames written.  Raises IOError if any marked frame could not
+    be read, after writing the ones that could.
+    """
+    import cv2
+
+    marks = sorted(marks, key=lambda mark: mark.position_ms)
+    if not marks:
+        return 0
+
+    video = cv2.VideoCapture(source)
+    if not video.isOpened():
+        raise IOError(f"unable to open {source}")
+
+    fps = video.get(cv2.CAP_PROP_FPS) or 30
+    frame_duration_ms = 1000 / fps
+
+    written = 0
+    pending = deque()
+    unread = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as encoders:
+            video.set(cv2.CAP_PROP_POS_MSEC, max(marks[0].position_ms - frame_duration_ms, 0))
+
+            i = 0
+            while i < len(marks):
+                if token is not None:
+                    token.raise_if_cancelled()
+
+                if not video.grab():
+                    # Past the end of the video as far as the decoder is concerned
+                    unread.extend(marks[i:])
+                    break
+                frame_ms = video.get(cv2.CAP_PROP_POS_MSEC)
+                if marks[i].position_ms >= frame_ms + frame_duration_ms:
+                    continue
+
+                success, image = video.retrieve()
+                while i < len(marks) and marks[i].position_ms < frame_ms + frame_duration_ms:
+                    if success:
+                        pending.append(
+                            encoders.submit(
+                                writer.write,
+                                marks[i].stem(video_id),
+                                image,
+                                marks[i].boxes,
+                            )
+                        )
+                    else:
+                        unread.append(marks[i])
+                    i += 1
+
+                # Bound the number of decoded frames waiting for an encoder
+                while len(pending) > 2 * max_workers or (pending and pending[0].done()):
+                    pending.popleft().result()
+                    written += 1
+                    if on_progress is not None:
+                        on_progress(written, len(marks))
+
+            while pending:
+                pending.popleft().result()
+                written += 1
+                if on_progress is not None:
+                    on_progress(written, len(marks))
+    finally:
+        video.release()
+
+    if unread:
+        positions = ", ".join(str(mark.position_ms) for mark in unread[:5])
+        raise IOError(
+            f"unable to read {len(unread)} of {len(marks)} marked frames of {source}, "
+            f"at {positions}{', ...' if len(unread) > 5 else ''} ms"
+        )
+    return written
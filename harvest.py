@@ -0,0 +1,141 @@
+"""
+Resolves every video of YouTube-8M labels or tags into a local manifest, without the GUI.
+
+    python harvest.py --manifest videos.sqlite "Car" "Snow" /m/0k4j
+
+Looking up a video name takes one request per id, so this is rate limited and spread over a few
+threads.  Results are committed in batches and only ids that have not been looked up yet are
+requested, so an interrupted harvest continues where it stopped when run again.  Start the GUI with
+`--manifest videos.sqlite` to browse harvested labels without network lookups.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import List
+
+from manifest import VideoManifest
+from youtube_8m import YouTube8mClient
+
+
+class RateLimiter(object):
+    """Spaces calls to acquire() at least 1 / rate seconds apart, across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._lock = Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def resolve_tags(labels, names_or_tags: List[str]) -> List[str]:
+    tags = []
+    for name_or_tag in names_or_tags:
+        if name_or_tag in labels:
+            tags.append(labels[name_or_tag][0].replace("/m/", ""))
+        elif name_or_tag.startswith("/m/"):
+            tags.append(name_or_tag.replace("/m/", ""))
+        else:
+            print(f"skipping {name_or_tag}: not a label name or /m/ tag")
+    return tags
+
+
+def harvest(
+    manifest: VideoManifest,
+    client: YouTube8mClient,
+    tags: List[str],
+    concurrency: int,
+    rate: float,
+    ids_only: bool = False,
+    batch_size: int = 100,
+) -> int:
+    """Resolve every id of tags that is not in the manifest yet.  Returns the number resolved."""
+    for tag in tags:
+        if not manifest.has_tag(tag):
+            ids = client.fetch_ids_for_tag(tag)
+            manifest.put_tag_ids(tag, ids)
+            print(f"{tag}: {len(ids)} videos")
+
+    if ids_only:
+        return 0
+
+    ids = manifest.unresolved_ids(tags)
+    print(f"{len(ids)} videos to look up")
+
+    limiter = RateLimiter(rate)
+
+    def lookup(id):
+        limiter.acquire()
+        try:
+            return id, client.get_yt_link_from_id(id)
+        except Exception as e:
+            # Left unresolved, to be retried on the next run
+            print(f"{id}: {e}")
+            return id, None
+
+    resolved = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as p:
+        for i in range(0, len(ids), batch_size):
+            results = [
+                (id, name)
+                for id, name in p.map(lookup, ids[i : i + batch_size])
+                if name is not None
+            ]
+            manifest.put_names(results)
+            resolved += len(results)
+
+            elapsed = time.perf_counter() - start
+            done = min(i + batch_size, len(ids))
+            print(f"[{done}/{len(ids)}] {resolved} resolved, {done / elapsed:.1f} lookups/s")
+
+    return resolved
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("labels", nargs="+", help="label names or /m/ tags to harvest")
+    parser.add_argument("--manifest", required=True, help="SQLite file to create or add to")
+    parser.add_argument("--concurrency", type=int, default=8, help="lookups in flight at once")
+    parser.add_argument("--rate", type=float, default=20, help="lookups per second at most")
+    parser.add_argument(
+        "--ids-only",
+        action="store_true",
+        help="only fetch the tags' id lists (one request per tag), e.g. for tag_index.py",
+    )
+    return parser.parse_args(argv[1:])
+
+
+def main(argv) -> int:
+    args = parse_args(argv)
+
+    manifest = VideoManifest(args.manifest)
+    # The client itself does not use the manifest, so ids and labels come fresh from the network
+    client = YouTube8mClient()
+
+    labels = manifest.labels()
+    if not labels:
+        labels = client.fetch_labels()
+        manifest.put_labels(labels)
+
+    tags = resolve_tags(labels, args.labels)
+    try:
+        harvest(manifest, client, tags, args.concurrency, args.rate, args.ids_only)
+    except KeyboardInterrupt:
+        print("interrupted, run again to continue")
+        return 1
+    finally:
+        manifest.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
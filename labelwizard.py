@@ -1,27 +1,63 @@
+from benchmark import IdleCpuMeter, StartupTimer
+
+startup_timer = StartupTimer()
+
 import sys
 import glob
 import os
+import argparse
+import multiprocessing
 
-from PySide6.QtCore import Qt, QSize
+from PySide6.QtCore import Qt, QSize, QTimer, Signal, Slot
+from PySide6.QtGui import QPaintEvent
 from PySide6.QtWidgets import QApplication, QSplitter, QHBoxLayout, QWidget
 from widgets.video_selection_panel import VideoSelectionPanel
-from widgets.video_player import VideoPlayer, FNAME_PREFIX
 
+from library import DEFAULT_INDEX_FNAME, LibraryIndex
+from streams import StreamManifestCache
+from task_scheduler import TaskScheduler
 from youtube_8m import YouTube8mClient
 
+startup_timer.mark("imports")
+
 
 class MyWidget(QWidget):
-    def __init__(self):
-        QWidget.__init__(self)
+    first_paint = Signal()
+    ready = Signal()
 
-        self.yt8m_client = YouTube8mClient()
+    def __init__(
+        self, manifest_fname=None, tag_index_folder=None, library_fname=DEFAULT_INDEX_FNAME
+    ):
+        QWidget.__init__(self)
 
-        self.video_selection_panel = VideoSelectionPanel(self.yt8m_client, self)
-        self.frame_sweeper = VideoPlayer(self)
+        self.painted = False
+
+        manifest = None
+        if manifest_fname is not None:
+            from manifest import VideoManifest
+
+            manifest = VideoManifest(manifest_fname)
+        self.task_scheduler = TaskScheduler(parent=self)
+        self.task_scheduler.add_pool("manifests", 2)
+        # A page of ten videos is looked up at once, by a task on the default pool
+        self.task_scheduler.add_pool("lookups", 10)
+        # Library scans, exports and pre-labeling whole videos can take minutes, and would
+        # otherwise hold the default pool's workers, so that loading a video waits for them
+        self.task_scheduler.add_pool("jobs", 2)
+        self.yt8m_client = YouTube8mClient(manifest, tag_index_folder, self.task_scheduler)
+        self.manifest_cache = StreamManifestCache()
+        self.library = LibraryIndex(library_fname)
+
+        self.video_selection_panel = VideoSelectionPanel(
+            self.yt8m_client, self.task_scheduler, self.manifest_cache, self.library, self
+        )
+        # The video player pulls in QtMultimedia and opens a media backend, so it is only built
+        # once the window has been painted.  Until then an empty widget holds its place.
+        self.frame_sweeper = None
 
         self.splitter = QSplitter(Qt.Horizontal)
         self.splitter.addWidget(self.video_selection_panel)
-        self.splitter.addWidget(self.frame_sweeper)
+        self.splitter.addWidget(QWidget())
 
         # Only stretch the left side when the window is resized
         self.splitter.setStretchFactor(0, 0)
@@ -30,21 +66,112 @@ class MyWidget(QWidget):
         self.layout = QHBoxLayout(self)
         self.layout.addWidget(self.splitter)
 
-        self.video_selection_panel.thumbnail_gallery.video_selected.connect(
-            self.frame_sweeper.load_video
-        )
+        self.first_paint.connect(self._schedule_deferred_init, Qt.QueuedConnection)
 
     def sizeHint(self) -> QSize:
         return QSize(800, 600)
 
+    def paintEvent(self, event: QPaintEvent) -> None:
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            self.first_paint.emit()
+
+    @Slot()
+    def _schedule_deferred_init(self):
+        QTimer.singleShot(0, self._deferred_init)
+
+    def _deferred_init(self):
+        from widgets.video_player import VideoPlayer
+
+        self.frame_sweeper = VideoPlayer(self.task_scheduler, self.manifest_cache, self)
+        self.splitter.replaceWidget(1, self.frame_sweeper).deleteLater()
+
+        self.video_selection_panel.thumbnail_gallery.video_selected.connect(
+            self.frame_sweeper.load_video
+        )
+        self.video_selection_panel.label_picker.fetch_labels()
+
+        self.ready.emit()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Annotate YouTube videos with bounding boxes.")
+    parser.add_argument(
+        "--startup-time",
+        action="store_true",
+        help="print import and first-paint timings, then exit once startup has finished",
+    )
+    parser.add_argument(
+        "--idle-cpu",
+        type=float,
+        metavar="SECONDS",
+        help="once started, measure the CPU used while idle for SECONDS, print it and exit",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="browse labels and videos harvested with harvest.py instead of looking them up",
+    )
+    parser.add_argument(
+        "--index",
+        help="tag index built with tag_index.py, for queries like 'Car & Snow - Truck'",
+    )
+    parser.add_argument(
+        "--library",
+        default=DEFAULT_INDEX_FNAME,
+        help="index of the local videos scanned so far, see library.py",
+    )
+    # Anything not recognized here (e.g. -style) is passed on to Qt
+    return parser.parse_known_args(argv[1:])
+
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    # Local videos are scanned in worker processes, which must not start another window when
+    # running from the built executable
+    multiprocessing.freeze_support()
+
+    args, qt_args = parse_args(sys.argv)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+
+    widget = MyWidget(args.manifest, args.index, args.library)
+    startup_timer.mark("window constructed")
+    widget.first_paint.connect(lambda: startup_timer.mark("first paint"))
+    widget.ready.connect(lambda: startup_timer.mark("deferred init"))
+    idle_cpu_meter = IdleCpuMeter()
+    if args.idle_cpu is not None:
+
+        def measure_idle_cpu():
+            idle_cpu_meter.start()
+
+            def finish():
+                idle_cpu_meter.stop()
+                app.quit()
+
+            QTimer.singleShot(int(args.idle_cpu * 1000), finish)
 
-    widget = MyWidget()
+        # Not from `ready`: the label list is still being downloaded and parsed then
+        label_picker = widget.video_selection_panel.label_picker
+        label_picker.labels_fetched.connect(measure_idle_cpu, Qt.QueuedConnection)
+        label_picker.labels_failed.connect(measure_idle_cpu, Qt.QueuedConnection)
+    elif args.startup_time:
+        widget.ready.connect(app.quit, Qt.QueuedConnection)
     widget.show()
 
     return_value = app.exec()
+    widget.task_scheduler.shutdown()
+    widget.library.close()
+    if widget.frame_sweeper is not None:
+        widget.frame_sweeper.close_output_writer()
+        widget.frame_sweeper.close_prelabeler()
+
+    if args.startup_time:
+        print(startup_timer.report())
+    if args.idle_cpu is not None:
+        print(idle_cpu_meter.report())
+
+    # Imported here rather than at the top so the multimedia stack is not loaded before first paint
+    from widgets.video_player import FNAME_PREFIX
 
     for fname in glob.glob(f"./{FNAME_PREFIX}*.mp4"):
         os.remove(fname)
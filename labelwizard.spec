@@ -12,7 +12,10 @@ a = Analysis(['labelwizard.py'],
              hookspath=[],
              hooksconfig={},
              runtime_hooks=[],
-             excludes=[],
+             # Not used by the app; excluding them keeps the one-file archive small, which is
+             # what the bootloader has to unpack on every launch
+             excludes=['tkinter', 'matplotlib', 'IPython', 'PySide6.QtWebEngineCore',
+                       'PySide6.QtWebEngineWidgets', 'PySide6.Qt3DCore', 'PySide6.QtQuick3D'],
              win_no_prefer_redirects=False,
              win_private_assemblies=False,
              cipher=block_cipher,
@@ -30,7 +33,8 @@ exe = EXE(pyz,
           debug=False,
           bootloader_ignore_signals=False,
           strip=False,
-          upx=True,
+          # UPX-compressed Qt libraries have to be decompressed at every start
+          upx=False,
           upx_exclude=[],
           runtime_tmpdir=None,
           console=True,
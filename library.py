@@ -0,0 +1,304 @@
+"""
+Library of local video files, e.g. footage from our own cameras, to annotate alongside YouTube
+videos.  Enter a folder in the label box of the GUI to browse the videos in it, or scan ahead of
+time with
+
+    python library.py /mnt/footage/2023 /mnt/footage/2024
+
+Each video is opened once with OpenCV for its duration, frame rate, resolution and a thumbnail,
+in parallel processes.  The results are kept in an index (by default in ~/.cache/labelwizard)
+keyed by path, modification time and size, so later scans only open new or changed files.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+VIDEO_EXTENSIONS = {".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm"}
+DEFAULT_INDEX_FNAME = os.path.join(
+    os.path.expanduser("~"), ".cache", "labelwizard", "library.sqlite"
+)
+# Thumbnails fit in the gallery's 16:9 box, at twice its size so they stay sharp on high DPI
+# screens.  Other aspect ratios (4:3, portrait phone footage) are kept, not stretched.
+THUMBNAIL_SIZE = (2 * 8 * 16, 2 * 8 * 9)
+# Bumped whenever probe_video() changes what it stores, so that every video is probed again
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    duration_ms REAL NOT NULL,
+    fps REAL NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    -- JPEG, empty if no frame could be read
+    thumbnail BLOB NOT NULL
+);
+"""
+
+
+def local_video_id(path: str) -> str:
+    """
+    Stands in for the YouTube video id, in session and frame file names.  Cameras reuse file names
+    (cam1/GOPR0001.MP4, cam2/GOPR0001.MP4), so a hash of the full path keeps the ids apart.
+    """
+    path = os.path.abspath(path)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:8]
+    return f"{os.path.splitext(os.path.basename(path))[0]}_{digest}"
+
+
+class VideoInfo(object):
+    """What the library knows about a video file.  `thumbnail` is None if it was not loaded."""
+
+    __slots__ = ("path", "mtime_ns", "size", "duration_ms", "fps", "width", "height", "thumbnail")
+
+    def __init__(
+        self,
+        path: str,
+        mtime_ns: int,
+        size: int,
+        duration_ms: float,
+        fps: float,
+        width: int,
+        height: int,
+        thumbnail: Optional[bytes],
+    ):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.duration_ms = duration_ms
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.thumbnail = thumbnail
+
+    @property
+    def video_id(self) -> str:
+        return local_video_id(self.path)
+
+    def row(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+def probe_video(path: str, mtime_ns: int, size: int) -> VideoInfo:
+    """Read the properties and a thumbnail of a video file.  Runs in a worker process."""
+    import cv2
+
+    video = cv2.VideoCapture(path)
+    try:
+        if not video.isOpened():
+            raise IOError("unable to open")
+
+        # OpenCV returns -1 (or 0) for properties it does not know, e.g. of a truncated file
+        fps = max(video.get(cv2.CAP_PROP_FPS), 0.0)
+        frame_count = max(video.get(cv2.CAP_PROP_FRAME_COUNT), 0.0)
+        width = max(int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), 0)
+        height = max(int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)), 0)
+        duration_ms = 1000 * frame_count / fps if fps else 0.0
+
+        # The first frame is often black, take one a little way in
+        if duration_ms:
+            video.set(cv2.CAP_PROP_POS_MSEC, min(duration_ms / 10, 5000))
+        success, image = video.read()
+    finally:
+        video.release()
+
+    thumbnail = b""
+    if success:
+        scale = min(THUMBNAIL_SIZE[0] / image.shape[1], THUMBNAIL_SIZE[1] / image.shape[0])
+        dsize = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+        image = cv2.resize(image, dsize, interpolation=cv2.INTER_AREA)
+        success, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if success:
+            thumbnail = encoded.tobytes()
+
+    return VideoInfo(path, mtime_ns, size, duration_ms, fps, width, height, thumbnail)
+
+
+def _probe_video(args) -> VideoInfo:
+    path, mtime_ns, size = args
+    try:
+        return probe_video(path, mtime_ns, size)
+    except Exception as e:
+        print(f"error reading {path}: {e}")
+        # Recorded anyway so an unreadable file is not opened again until it changes
+        return VideoInfo(path, mtime_ns, size, 0.0, 0.0, 0, 0, b"")
+
+
+def find_videos(folder: str) -> Iterator[Tuple[str, int, int]]:
+    """(path, mtime_ns, size) of every video file under folder."""
+    # os.scandir gets the file type (and on Windows the stat) with the directory listing
+    stack = [folder]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError as e:
+            print(f"unable to list {e.filename}: {e.strerror}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS:
+                stat = entry.stat()
+                yield entry.path, stat.st_mtime_ns, stat.st_size
+
+
+class LibraryIndex(object):
+    """
+    SQLite index of probed videos, keyed by absolute path.  A row is reused for as long as the
+    file's modification time and size are unchanged.  Safe to use from several threads.
+    """
+
+    def __init__(self, fname: str = DEFAULT_INDEX_FNAME):
+        self.fname = fname
+        self._lock = Lock()
+        self._connection = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Opened on first use, with the lock held, so that creating an index (e.g. while the GUI
+        # builds its first window) does not touch the disk
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.fname)), exist_ok=True)
+            self._connection = sqlite3.connect(self.fname, check_same_thread=False)
+            with self._connection:
+                self._connection.executescript(SCHEMA)
+                (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+                if version < 1:
+                    # Thumbnails were stretched to 16:9
+                    self._connection.execute("DELETE FROM videos")
+                if version < 2:
+                    # OpenCV's -1 for unknown properties was stored as is
+                    self._connection.execute(
+                        "DELETE FROM videos WHERE fps < 0 OR width < 0 OR height < 0"
+                    )
+                self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return self._connection
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _folder_clause(self, folder: str) -> Tuple[str, tuple]:
+        # Every path under folder sorts between "folder/" and "folder0", as "0" follows "/"
+        prefix = os.path.join(folder, "")
+        return "path >= ? AND path < ?", (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+    def stats(self, folder: str) -> dict:
+        """{path: (mtime_ns, size)} of the indexed videos under folder."""
+        clause, params = self._folder_clause(folder)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT path, mtime_ns, size FROM videos WHERE {clause}", params
+            ).fetchall()
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def videos(self, folder: str) -> List[VideoInfo]:
+        """The indexed videos under folder, sorted by path, without their thumbnails."""
+        clause, params = self._folder_clause(folder)
+        with self._lock:
+            rows = self._db.execute(
+                f"""
+                SELECT path, mtime_ns, size, duration_ms, fps, width, height FROM videos
+                WHERE {clause} ORDER BY path
+                """,
+                params,
+            ).fetchall()
+        return [VideoInfo(*row, thumbnail=None) for row in rows]
+
+    def thumbnail(self, path: str) -> bytes:
+        """The JPEG thumbnail of path, empty if it has none."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT thumbnail FROM videos WHERE path = ?", (path,)
+            ).fetchone()
+        return row[0] if row is not None else b""
+
+    def put(self, videos: Iterable[VideoInfo]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [video.row() for video in videos],
+            )
+
+    def remove(self, paths: Iterable[str]) -> None:
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM videos WHERE path = ?", [(path,) for path in paths])
+
+
+def scan(
+    index: LibraryIndex,
+    folder: str,
+    jobs: int = os.cpu_count(),
+    token=None,
+    batch_size: int = 64,
+) -> List[VideoInfo]:
+    """
+    Bring the index up to date with the videos under folder and return them, sorted by path.
+    Only new and changed files are opened; files that are gone are dropped from the index.
+    """
+    folder = os.path.abspath(os.path.expanduser(folder))
+
+    indexed = index.stats(folder)
+    found = set()
+    changed = []
+    for path, mtime_ns, size in find_videos(folder):
+        found.add(path)
+        if indexed.get(path) != (mtime_ns, size):
+            changed.append((path, mtime_ns, size))
+    index.remove(path for path in indexed if path not in found)
+
+    if changed:
+        print(f"{folder}: reading {len(changed)} new or changed videos")
+        # Scans run from the GUI's worker threads, and forking a process with Qt's and OpenCV's
+        # threads running can deadlock the child
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(changed)), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            for i in range(0, len(changed), batch_size):
+                if token is not None:
+                    token.raise_if_cancelled()
+                # Probed before taking the index lock
+                index.put(list(pool.map(_probe_video, changed[i : i + batch_size])))
+
+    return index.videos(folder)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("folders", nargs="+", help="folders to scan for videos, recursively")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FNAME, help="SQLite file to keep")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="videos read in parallel")
+    return parser.parse_args(argv[1:])
+
+
+def main(argv) -> int:
+    args = parse_args(argv)
+
+    index = LibraryIndex(args.index)
+    try:
+        for folder in args.folders:
+            start = time.perf_counter()
+            videos = scan(index, folder, args.jobs)
+            hours = sum(video.duration_ms for video in videos) / (60 * 60 * 1000)
+            print(
+                f"{folder}: {len(videos)} videos, {hours:.1f} h, "
+                f"in {time.perf_counter() - start:.1f} s"
+            )
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,141 @@
+import sqlite3
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    name TEXT PRIMARY KEY,
+    tag TEXT NOT NULL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS tag_videos (
+    tag TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (tag, position)
+);
+CREATE INDEX IF NOT EXISTS tag_videos_id ON tag_videos (id);
+-- name is NULL until the id has been looked up, and '' if it has no public video
+CREATE TABLE IF NOT EXISTS videos (
+    id TEXT PRIMARY KEY,
+    name TEXT
+);
+"""
+
+
+class VideoManifest(object):
+    """
+    Local copy of the YouTube-8M lookups for the labels harvested with harvest.py: the label list,
+    every tag's ordered id list and the video name each id resolves to.  With a manifest,
+    YouTube8mClient serves labels and videos without network access.
+
+    Tags are stored without their "/m/" prefix, like in YouTube8mClient.  Safe to use from several
+    threads.
+    """
+
+    def __init__(self, fname: str):
+        self.fname = fname
+        self._lock = Lock()
+        self._connection = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Opened on first use, with the lock held, so that the GUI can create its manifest before
+        # the window is shown without touching the disk
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.fname, check_same_thread=False)
+            with self._connection:
+                self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def put_labels(self, labels: Dict[str, Tuple[str, str]]) -> None:
+        """Store labels in the format returned by YouTube8mClient.fetch_labels()."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO labels (name, tag, extra) VALUES (?, ?, ?)",
+                [(name, tag, extra) for name, (tag, extra) in labels.items()],
+            )
+
+    def labels(self) -> Dict[str, Tuple[str, str]]:
+        with self._lock:
+            rows = self._db.execute("SELECT name, tag, extra FROM labels").fetchall()
+        return {name: (tag, extra) for name, tag, extra in rows}
+
+    def has_tag(self, tag: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM tag_videos WHERE tag = ? LIMIT 1", (tag,)
+            ).fetchone()
+        return row is not None
+
+    def put_tag_ids(self, tag: str, ids: List[str]) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM tag_videos WHERE tag = ?", (tag,))
+            self._db.executemany(
+                "INSERT INTO tag_videos (tag, position, id) VALUES (?, ?, ?)",
+                [(tag, position, id) for position, id in enumerate(ids)],
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO videos (id, name) VALUES (?, NULL)", [(id,) for id in ids]
+            )
+
+    def tag_ids(self, tag: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM tag_videos WHERE tag = ? ORDER BY position", (tag,)
+            ).fetchall()
+        return [id for id, in rows]
+
+    def tags(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT tag FROM tag_videos").fetchall()
+        return [tag for tag, in rows]
+
+    def unresolved_ids(self, tags: Iterable[str]) -> List[str]:
+        ids = []
+        with self._lock:
+            for tag in tags:
+                rows = self._db.execute(
+                    """
+                    SELECT videos.id FROM tag_videos JOIN videos ON videos.id = tag_videos.id
+                    WHERE tag_videos.tag = ? AND videos.name IS NULL ORDER BY tag_videos.position
+                    """,
+                    (tag,),
+                ).fetchall()
+                ids.extend(id for id, in rows)
+        # An id can be in several tags
+        return list(dict.fromkeys(ids))
+
+    def put_names(self, names: Iterable[Tuple[str, str]]) -> None:
+        """Record the video names that (id, name) pairs resolved to."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE videos SET name = ? WHERE id = ?", [(name, id) for id, name in names]
+            )
+
+    def name(self, id: str) -> Optional[str]:
+        """The video name of id, '' if it has none, or None if it has not been looked up."""
+        with self._lock:
+            row = self._db.execute("SELECT name FROM videos WHERE id = ?", (id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def names(self, ids: List[str]) -> List[Optional[str]]:
+        """name() of every id, in the same order."""
+        with self._lock:
+            found = {}
+            # Stay below SQLite's limit on the number of query parameters
+            for i in range(0, len(ids), 500):
+                chunk = ids[i : i + 500]
+                found.update(
+                    self._db.execute(
+                        f"SELECT id, name FROM videos WHERE id IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                )
+        return [found.get(id) for id in ids]
@@ -0,0 +1,264 @@
+"""
+Box proposals from a user-supplied ONNX detector (e.g. a YOLOv5 or YOLOv8 export), run on the CPU
+with OpenCV's DNN module, so that frames start out with boxes to correct instead of none.
+
+The detector runs in a worker process, so inference never competes with the UI for the GIL, and
+is given several frames per forward pass.  Proposals are cached on disk per model, video and
+frame, so a frame is only ever detected once.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "labelwizard", "proposals")
+
+# A YoloBox followed by the detector's confidence in it:
+# (class id, x center, y center, width, height, score), normalized to the frame
+Proposal = Tuple[int, float, float, float, float, float]
+
+
+class Detector(object):
+    """
+    A YOLO-style detector.  Frames are resized to input_size x input_size without letterboxing,
+    so coordinates normalized to the network input are also normalized to the frame.
+    """
+
+    def __init__(
+        self,
+        model_fname: str,
+        input_size: int = 640,
+        score_threshold: float = 0.25,
+        nms_threshold: float = 0.45,
+    ):
+        import cv2
+
+        self.net = cv2.dnn.readNetFromONNX(model_fname)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.input_size = input_size
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        # Models exported with a fixed batch size of 1 fail on larger batches
+        self.batching = True
+
+    def _forward(self, images):
+        import cv2
+
+        blob = cv2.dnn.blobFromImages(
+            images, 1 / 255, (self.input_size, self.input_size), swapRB=True, crop=False
+        )
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def detect(self, images) -> List[List[Proposal]]:
+        """Proposals for each of a batch of BGR images."""
+        import cv2
+
+        if self.batching and len(images) > 1:
+            try:
+                return [self._proposals(output) for output in self._forward(images)]
+            except cv2.error:
+                print("model does not accept batches, detecting one frame at a time")
+                self.batching = False
+        return [self._proposals(self._forward([image])[0]) for image in images]
+
+    def _proposals(self, output) -> List[Proposal]:
+        import cv2
+        import numpy as np
+
+        if output.shape[0] < output.shape[1]:
+            # YOLOv8 and later: (4 + classes, candidates), without an objectness score
+            output = output.T
+            class_scores = output[:, 4:]
+        else:
+            # YOLOv5: (candidates, 5 + classes)
+            class_scores = output[:, 5:] * output[:, 4:5]
+
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        keep = scores >= self.score_threshold
+        centers, class_ids, scores = output[keep, :4], class_ids[keep], scores[keep]
+
+        corners = centers.copy()
+        corners[:, :2] -= centers[:, 2:] / 2
+
+        # Boxes of different classes do not suppress each other.  NMSBoxesBatched does this in one
+        # call, but only exists since OpenCV 4.7.
+        kept = []
+        for class_id in np.unique(class_ids):
+            (members,) = np.nonzero(class_ids == class_id)
+            class_kept = cv2.dnn.NMSBoxes(
+                corners[members].tolist(),
+                scores[members].tolist(),
+                self.score_threshold,
+                self.nms_threshold,
+            )
+            kept.extend(members[np.array(class_kept, dtype=int).flatten()])
+
+        proposals = []
+        for i in kept:
+            x, y, w, h = (centers[i] / self.input_size).tolist()
+            proposals.append((int(class_ids[i]), x, y, w, h, float(scores[i])))
+        return proposals
+
+
+# The detector of the current worker process, see init_worker()
+detector = None
+
+
+def init_worker(model_fname: str, input_size: int, score_threshold: float, nms_threshold: float):
+    global detector
+
+    detector = Detector(model_fname, input_size, score_threshold, nms_threshold)
+
+
+def detect_frames(source: str, positions_ms: List[int]) -> Dict[int, List[Proposal]]:
+    """Runs in the worker process.  Proposals for the frames of source at positions_ms."""
+    import cv2
+
+    frames = {}
+    video = cv2.VideoCapture(source)
+    try:
+        for position_ms in positions_ms:
+            video.set(cv2.CAP_PROP_POS_MSEC, position_ms)
+            success, image = video.read()
+            if success:
+                frames[position_ms] = image
+    finally:
+        video.release()
+
+    if not frames:
+        return {}
+    return dict(zip(frames, detector.detect(list(frames.values()))))
+
+
+def check_model() -> None:
+    """Runs in the worker process.  Raises if the model cannot detect a frame."""
+    import numpy as np
+
+    detector.detect([np.zeros((detector.input_size, detector.input_size, 3), dtype=np.uint8)])
+
+
+class ProposalCache(object):
+    """
+    Proposals kept as <cache folder>/<model key>/<video id>.jsonl, where the model key changes
+    whenever the model file or the detection settings do.  Each put() appends one line with the
+    proposals of its frames, so caching a long video one batch at a time stays linear.  Safe to
+    use from several threads.
+    """
+
+    def __init__(self, folder: str, model_fname: str, settings: tuple):
+        stat = os.stat(model_fname)
+        key = repr((os.path.abspath(model_fname), stat.st_mtime_ns, stat.st_size, settings))
+        self.folder = os.path.join(folder, hashlib.sha1(key.encode()).hexdigest()[:16])
+        self._lock = Lock()
+        self._videos = {}
+
+    def _frames(self, video_id: str) -> Dict[int, List[Proposal]]:
+        # Called with the lock held
+        if video_id not in self._videos:
+            frames = {}
+            fname = self._fname(video_id)
+            if os.path.exists(fname):
+                with open(fname) as f:
+                    for line in f:
+                        # A line cut short by a crash is ignored, those frames are detected again
+                        if not line.endswith("\n"):
+                            continue
+                        for position_ms, proposals in json.loads(line).items():
+                            frames[int(position_ms)] = [tuple(proposal) for proposal in proposals]
+            self._videos[video_id] = frames
+        return self._videos[video_id]
+
+    def _fname(self, video_id: str) -> str:
+        return os.path.join(self.folder, f"{video_id}.jsonl")
+
+    def get(self, video_id: str, position_ms: int) -> Optional[List[Proposal]]:
+        with self._lock:
+            return self._frames(video_id).get(position_ms)
+
+    def positions(self, video_id: str) -> List[int]:
+        """The cached frames of video_id, in order."""
+        with self._lock:
+            return sorted(self._frames(video_id))
+
+    def put(self, video_id: str, proposals: Dict[int, List[Proposal]]) -> None:
+        with self._lock:
+            self._frames(video_id).update(proposals)
+
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self._fname(video_id), "a") as f:
+                f.write(json.dumps(proposals) + "\n")
+
+
+class Prelabeler(object):
+    """
+    Detects frames with model_fname in a worker process of its own, batch_size frames at a time,
+    through a ProposalCache.  propose() blocks, so call it from a task scheduler worker.
+    """
+
+    def __init__(
+        self,
+        model_fname: str,
+        cache_folder: str = DEFAULT_CACHE_FOLDER,
+        batch_size: int = 8,
+        input_size: int = 640,
+        score_threshold: float = 0.25,
+        nms_threshold: float = 0.45,
+    ):
+        self.model_fname = model_fname
+        self.batch_size = batch_size
+        settings = (input_size, score_threshold, nms_threshold)
+        self.cache = ProposalCache(cache_folder, model_fname, settings)
+        # Forking the GUI process while Qt's and OpenCV's threads run can deadlock the child
+        self.pool = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(model_fname, *settings),
+        )
+
+    def propose(
+        self,
+        video_id: str,
+        source: str,
+        positions_ms: List[int],
+        token=None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Dict[int, List[Proposal]]:
+        """Proposals for the frames of source at positions_ms.  Cached frames are not detected."""
+        proposals = {}
+        missing = []
+        for position_ms in positions_ms:
+            cached = self.cache.get(video_id, position_ms)
+            if cached is None:
+                missing.append(position_ms)
+            else:
+                proposals[position_ms] = cached
+
+        for i in range(0, len(missing), self.batch_size):
+            if token is not None:
+                token.raise_if_cancelled()
+            # Submitted a batch at a time, so that a single frame requested meanwhile (e.g. by
+            # another task) does not wait for the whole video
+            found = self.pool.submit(detect_frames, source, missing[i : i + self.batch_size])
+            found = found.result()
+            self.cache.put(video_id, found)
+            proposals.update(found)
+            if on_progress is not None:
+                on_progress(min(i + self.batch_size, len(missing)), len(missing))
+        return proposals
+
+    def check(self) -> None:
+        """
+        Load the model in the worker process and detect a blank frame.  A model OpenCV cannot
+        read or whose output is not understood fails here, rather than on the first proposal.
+        """
+        self.pool.submit(check_model).result()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
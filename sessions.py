@@ -0,0 +1,71 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from dataset import YoloBox
+from exporter import Mark
+
+SESSIONS_FOLDER = "sessions"
+
+# Like a YoloBox, but with the label name instead of its index, so that sessions stay valid when
+# the labels file changes
+NamedBox = Tuple[str, float, float, float, float]
+
+
+class AnnotationSession(object):
+    """
+    The marked frames of one video, saved as <output folder>/sessions/<video id>.json so that the
+    dataset can be exported again later without the GUI (see export_dataset.py).
+    """
+
+    def __init__(
+        self, video_id: str, source: str, marks: Optional[Dict[int, List[NamedBox]]] = None
+    ):
+        self.video_id = video_id
+        # A YouTube watch URL or a local file
+        self.source = source
+        self.marks = marks if marks is not None else {}
+
+    @staticmethod
+    def path(output_folder: str, video_id: str) -> str:
+        return os.path.join(output_folder, SESSIONS_FOLDER, f"{video_id}.json")
+
+    def add_mark(self, mark: Mark, names: List[str]) -> None:
+        self.marks[mark.position_ms] = [
+            (names[label_id], x, y, w, h) for label_id, x, y, w, h in mark.boxes
+        ]
+
+    def marks_for(self, names: List[str]) -> List[Mark]:
+        """The marks with their boxes numbered by `names`.  Boxes with other labels are dropped."""
+        marks = []
+        for position_ms, named_boxes in sorted(self.marks.items()):
+            boxes: List[YoloBox] = [
+                (names.index(name), x, y, w, h) for name, x, y, w, h in named_boxes if name in names
+            ]
+            marks.append(Mark(position_ms, boxes))
+        return marks
+
+    def save(self, fname: str) -> None:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        data = {
+            "video_id": self.video_id,
+            "source": self.source,
+            "marks": [
+                {"position_ms": position_ms, "boxes": [list(box) for box in boxes]}
+                for position_ms, boxes in sorted(self.marks.items())
+            ],
+        }
+        # Written next to the destination and renamed, so a reader never sees a partial file
+        with open(fname + ".tmp", "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(fname + ".tmp", fname)
+
+    @classmethod
+    def load(cls, fname: str) -> "AnnotationSession":
+        with open(fname, "r") as f:
+            data = json.load(f)
+        marks = {
+            int(mark["position_ms"]): [tuple(box) for box in mark["boxes"]]
+            for mark in data["marks"]
+        }
+        return cls(data["video_id"], data["source"], marks)
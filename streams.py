@@ -0,0 +1,189 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Optional, TYPE_CHECKING
+from urllib.parse import parse_qs, urlparse
+
+if TYPE_CHECKING:
+    from pytube import Stream, StreamQuery, YouTube
+
+PLAYBACK_HEIGHTS = [144, 240, 360, 480, 720]
+
+
+def stream_height(stream: "Stream") -> int:
+    if not stream.resolution:
+        return 0
+    return int(stream.resolution.replace("p", ""))
+
+
+class ResolutionPolicy(object):
+    """
+    Decides which YouTube stream is used for what.
+
+    Browsing and playback only need to be good enough to draw boxes on, so a small progressive
+    (audio+video) stream is downloaded.  Saved frames are read straight from a high resolution
+    video-only stream, seeking to the frame so only the surrounding bytes are fetched.
+    """
+
+    def __init__(self, playback_max_height: int = 360, export_max_height: int = 1080):
+        self.playback_max_height = playback_max_height
+        self.export_max_height = export_max_height
+
+    def playback_stream(self, streams: "StreamQuery") -> Optional["Stream"]:
+        candidates = sorted(streams.filter(progressive=True), key=stream_height)
+        if not candidates:
+            return None
+
+        chosen_stream = candidates[0]
+        for stream in candidates:
+            if stream_height(stream) <= self.playback_max_height:
+                chosen_stream = stream
+        return chosen_stream
+
+    def export_stream(self, streams: "StreamQuery") -> Optional["Stream"]:
+        # Only h.264, which every OpenCV build can decode.  YouTube also serves VP9 in webm and,
+        # from 720p up, AV1 in mp4, which the pinned OpenCV build may not.
+        candidates = sorted(
+            (
+                stream
+                for stream in streams.filter(only_video=True)
+                if stream.video_codec.startswith("avc1")
+            ),
+            key=stream_height,
+        )
+        chosen_stream = None
+        for stream in candidates:
+            if stream_height(stream) <= self.export_max_height:
+                chosen_stream = stream
+        return chosen_stream
+
+
+def read_frame(source: str, position_ms: float):
+    """
+    Decode the frame at position_ms from a local file or a URL.  For URLs, OpenCV's FFmpeg backend
+    seeks with range requests, so only the data around the frame is downloaded.
+    """
+    import cv2
+
+    video = cv2.VideoCapture(source)
+    try:
+        video.set(cv2.CAP_PROP_POS_MSEC, position_ms)
+        success, image = video.read()
+    finally:
+        video.release()
+
+    return image if success else None
+
+
+def download_stream(
+    stream: "Stream", fname: str, on_progress: Optional[Callable[[int], None]] = None
+) -> None:
+    """
+    Download stream to fname, calling on_progress with the number of bytes written so far after
+    every chunk.  An exception raised by on_progress aborts the download.
+    """
+    from pytube import request
+
+    written = 0
+    with open(fname, "wb") as f:
+        for chunk in request.stream(stream.url):
+            f.write(chunk)
+            written += len(chunk)
+            if on_progress is not None:
+                on_progress(written)
+
+
+class ResolvedVideo(object):
+    """
+    The resolved streams of a video.  Unlike the YouTube object they come from, this does not hold
+    on to the watch page, player script and video info, which add up to about a megabyte.
+    """
+
+    __slots__ = ("video_id", "watch_url", "streams", "expires_at")
+
+    def __init__(self, video_id: str, watch_url: str, streams: "StreamQuery", expires_at: float):
+        self.video_id = video_id
+        self.watch_url = watch_url
+        self.streams = streams
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_youtube(cls, yt: "YouTube") -> "ResolvedVideo":
+        # Evaluating streams fetches and deciphers them
+        streams = yt.streams
+        return cls(yt.video_id, yt.watch_url, streams, manifest_expiry(streams))
+
+
+class StreamManifestCache(object):
+    """
+    Resolving a video's streams fetches the watch page and deciphers the stream signatures, which
+    takes seconds.  This keeps the resolved streams, keyed by video id, until the signed stream
+    URLs are about to expire.
+
+    resolve() is thread-safe and blocks while another thread is resolving the same video, so a
+    click on a video that is being prefetched waits for the prefetch instead of starting over.
+    """
+
+    # Signed URLs normally expire after about 6 hours; assume less if the URL does not say
+    DEFAULT_LIFETIME_S = 60 * 60
+    # Do not hand out URLs that are about to expire, a download may take a while
+    EXPIRY_MARGIN_S = 10 * 60
+
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._video_locks = {}
+
+    def get(self, video_id: str) -> Optional[ResolvedVideo]:
+        with self._lock:
+            video = self._entries.get(video_id)
+            if video is None:
+                return None
+
+            if video.expires_at - self.EXPIRY_MARGIN_S < time.time():
+                del self._entries[video_id]
+                return None
+
+            self._entries.move_to_end(video_id)
+            return video
+
+    def put(self, video: ResolvedVideo) -> None:
+        with self._lock:
+            self._entries[video.video_id] = video
+            self._entries.move_to_end(video.video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def resolve(self, url: str) -> ResolvedVideo:
+        """Return the streams of the video at url, resolving them unless they are cached."""
+        from pytube import YouTube
+        from pytube.extract import video_id as extract_video_id
+
+        video_id = extract_video_id(url)
+        with self._lock:
+            video_lock = self._video_locks.setdefault(video_id, Lock())
+
+        try:
+            with video_lock:
+                video = self.get(video_id)
+                if video is None:
+                    video = ResolvedVideo.from_youtube(YouTube(url))
+                    self.put(video)
+        finally:
+            with self._lock:
+                self._video_locks.pop(video_id, None)
+        return video
+
+
+def manifest_expiry(streams: "StreamQuery") -> float:
+    """Time at which the first of the signed stream URLs expires."""
+    expiries = []
+    for stream in streams:
+        expire = parse_qs(urlparse(stream.url).query).get("expire")
+        if expire:
+            expiries.append(float(expire[0]))
+
+    if not expiries:
+        return time.time() + StreamManifestCache.DEFAULT_LIFETIME_S
+    return min(expiries)
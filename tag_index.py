@@ -0,0 +1,139 @@
+"""
+Inverted index from YouTube-8M tags to the ids of their videos, for multi-label queries.
+
+    python tag_index.py --manifest videos.sqlite --output index/
+
+builds the index from every tag in a manifest (harvest.py --ids-only fetches the id lists without
+looking up video names).  Start the GUI with `--index index/` and enter a query such as
+`Car & Snow`, `Truck - Video game` or `Car | Truck` to browse the matching videos.
+"""
+import argparse
+import os
+import re
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+QUERY_OPERATOR = re.compile(r"\s+([&|-])\s+")
+
+
+def is_query(text: str) -> bool:
+    return QUERY_OPERATOR.search(text) is not None
+
+
+class TagIndex(object):
+    """
+    Every distinct id is numbered by its position in the sorted `ids` array, and each tag's videos
+    are stored as a sorted uint32 array of those numbers.  All of them are concatenated into
+    `postings`, with tag i's array at postings[offsets[i] : offsets[i + 1]].
+
+    Saved as .npy files that are memory-mapped when loaded, so opening a large index is instant
+    and only the postings a query touches are read.  Queries run as vectorized set operations on
+    the sorted arrays.
+    """
+
+    FILES = ["ids", "tags", "offsets", "postings"]
+
+    def __init__(
+        self, ids: np.ndarray, tags: np.ndarray, offsets: np.ndarray, postings: np.ndarray
+    ):
+        self.ids = ids
+        self.tags = tags
+        self.offsets = offsets
+        self.postings = postings
+        self._tag_numbers = {tag.decode(): i for i, tag in enumerate(tags)}
+
+    @classmethod
+    def build(cls, tag_ids: Dict[str, List[str]]) -> "TagIndex":
+        tags = sorted(tag_ids)
+        all_ids = [id for tag in tags for id in tag_ids[tag]]
+        ids = np.unique(np.array(all_ids, dtype=bytes)) if all_ids else np.array([], dtype="S1")
+
+        postings = []
+        offsets = [0]
+        for tag in tags:
+            numbers = np.unique(np.searchsorted(ids, np.array(tag_ids[tag], dtype=bytes)))
+            postings.append(numbers.astype(np.uint32))
+            offsets.append(offsets[-1] + len(numbers))
+
+        return cls(
+            ids,
+            np.array(tags, dtype=bytes),
+            np.array(offsets, dtype=np.int64),
+            np.concatenate(postings) if postings else np.array([], dtype=np.uint32),
+        )
+
+    @classmethod
+    def from_manifest(cls, manifest) -> "TagIndex":
+        return cls.build({tag: manifest.tag_ids(tag) for tag in manifest.tags()})
+
+    def save(self, folder: str) -> None:
+        os.makedirs(folder, exist_ok=True)
+        for name in self.FILES:
+            np.save(os.path.join(folder, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, folder: str) -> "TagIndex":
+        return cls(
+            *(np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r") for name in cls.FILES)
+        )
+
+    def has_tag(self, tag: str) -> bool:
+        return tag.replace("/m/", "") in self._tag_numbers
+
+    def tag_postings(self, tag: str) -> np.ndarray:
+        i = self._tag_numbers[tag.replace("/m/", "")]
+        return self.postings[self.offsets[i] : self.offsets[i + 1]]
+
+    def query(self, expression: str, labels: Dict[str, tuple]) -> List[str]:
+        """
+        Ids of the videos matching an expression of label names (or /m/ tags) joined by
+        `&` (in both), `|` (in either) or `-` (in the first, not the second), evaluated left to
+        right.  The operators need spaces around them, as label names can contain `-`.
+        `labels` is in the format returned by YouTube8mClient.fetch_labels().
+        """
+        operands = QUERY_OPERATOR.split(expression.strip())
+
+        result = self._operand_postings(operands[0], labels)
+        for operator, operand in zip(operands[1::2], operands[2::2]):
+            postings = self._operand_postings(operand, labels)
+            if operator == "&":
+                result = np.intersect1d(result, postings, assume_unique=True)
+            elif operator == "|":
+                result = np.union1d(result, postings)
+            else:
+                result = np.setdiff1d(result, postings, assume_unique=True)
+
+        return [id.decode() for id in self.ids[result]]
+
+    def _operand_postings(self, operand: str, labels: Dict[str, tuple]) -> np.ndarray:
+        tag = labels[operand][0] if operand in labels else operand
+        if not self.has_tag(tag):
+            raise KeyError(f"{operand} is not in the index")
+        return self.tag_postings(tag)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--manifest", required=True, help="manifest created by harvest.py")
+    parser.add_argument("--output", required=True, help="folder to write the index to")
+    return parser.parse_args(argv[1:])
+
+
+def main(argv) -> int:
+    from manifest import VideoManifest
+
+    args = parse_args(argv)
+
+    manifest = VideoManifest(args.manifest)
+    index = TagIndex.from_manifest(manifest)
+    manifest.close()
+
+    index.save(args.output)
+    print(f"{len(index.tags)} tags, {len(index.ids)} videos, {len(index.postings)} postings")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
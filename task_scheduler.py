@@ -0,0 +1,223 @@
+from concurrent.futures import Future, wait
+from enum import IntEnum
+from threading import Event
+from typing import Callable, Iterable, List, Optional
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Priority(IntEnum):
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+class CancellationToken(object):
+    """
+    Shared between the code that submits work and the work itself.  Cancelling only sets a flag:
+    tasks that have not started are dropped, long-running tasks are expected to call
+    raise_if_cancelled() at convenient points, and results of cancelled tasks are discarded.
+    """
+
+    def __init__(self):
+        self._event = Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+
+class _Task(QRunnable):
+    def __init__(self, fn, args, token, on_result, on_error, relay, pool):
+        QRunnable.__init__(self)
+        # The scheduler owns the task, so that it can still be taken off the queue when cancelled
+        self.setAutoDelete(False)
+
+        self.pool = pool
+        self.fn = fn
+        self.args = args
+        self.token = token
+        self.on_result = on_result
+        self.on_error = on_error
+        self.relay = relay
+
+    def run(self):
+        if self.token.cancelled:
+            self.relay.failed.emit(self, TaskCancelled())
+            return
+
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            self.relay.failed.emit(self, e)
+        else:
+            self.relay.finished.emit(self, result)
+
+
+class _Call(QRunnable):
+    """One call of TaskScheduler.map(), reported through a future instead of the relay."""
+
+    def __init__(self, fn, args, token, calls):
+        QRunnable.__init__(self)
+        # Kept alive by the scheduler's set of calls until it has run
+        self.setAutoDelete(False)
+
+        self.fn = fn
+        self.args = args
+        self.token = token
+        self.future = Future()
+        self.calls = calls
+
+    def run(self):
+        try:
+            self.token.raise_if_cancelled()
+            self.future.set_result(self.fn(*self.args))
+        except Exception as e:
+            self.future.set_exception(e)
+        finally:
+            self.calls.discard(self)
+
+
+class _Relay(QObject):
+    """Lives on the UI thread, so signals emitted from workers are delivered there."""
+
+    finished = Signal(object, object)
+    failed = Signal(object, object)
+
+
+class TaskScheduler(QObject):
+    """
+    Runs background work on a bounded thread pool and hands results back on the UI thread.
+
+    Work that supersedes earlier work (a new tag, a new video) is submitted in a named group:
+    restart(group) cancels everything still running under the group's previous token.
+
+    Work that should not compete with the rest (e.g. speculative prefetching) can be given its own
+    named pool with add_pool() and submitted with pool=<name>.
+    """
+
+    def __init__(self, max_workers: int = 4, *args, **kwargs):
+        QObject.__init__(self, *args, **kwargs)
+
+        self.pools = {}
+        self.pool = self.add_pool("default", max_workers)
+
+        self.tasks = set()
+        self.calls = set()
+        self.groups = {}
+
+        self.relay = _Relay(self)
+        self.relay.finished.connect(self._task_finished)
+        self.relay.failed.connect(self._task_failed)
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        token: Optional[CancellationToken] = None,
+        priority: Priority = Priority.NORMAL,
+        on_result: Optional[Callable] = None,
+        on_error: Optional[Callable] = None,
+        pool: str = "default",
+    ) -> CancellationToken:
+        """
+        Call fn(*args) on a worker thread.  on_result(result) or on_error(exception) is then
+        called on the UI thread, unless the token was cancelled in the meantime.
+        """
+        if token is None:
+            token = CancellationToken()
+
+        task = _Task(fn, args, token, on_result, on_error, self.relay, self.pools[pool])
+        self.tasks.add(task)
+        task.pool.start(task, int(priority))
+        return token
+
+    def map(
+        self,
+        fn: Callable,
+        items: Iterable,
+        token: Optional[CancellationToken] = None,
+        pool: str = "default",
+    ) -> List:
+        """
+        Call fn(item) for every item on the named pool, and return the results in order once they
+        have all finished.  For a task that fans out into many small calls (e.g. network lookups)
+        without starting threads of its own.  Safe to call from a worker thread, but blocks it: the
+        calls must go to another pool than the caller's, or they may wait for it forever.
+        """
+        if token is None:
+            token = CancellationToken()
+
+        calls = [_Call(fn, (item,), token, self.calls) for item in items]
+        self.calls.update(calls)
+        for call in calls:
+            self.pools[pool].start(call)
+
+        futures = [call.future for call in calls]
+        # Calls cleared off the queue by shutdown() never finish
+        while wait(futures, timeout=0.1).not_done:
+            token.raise_if_cancelled()
+        return [future.result() for future in futures]
+
+    def add_pool(self, name: str, max_workers: int) -> QThreadPool:
+        pool = QThreadPool(self)
+        pool.setMaxThreadCount(max_workers)
+        self.pools[name] = pool
+        return pool
+
+    def token(self, group: str) -> CancellationToken:
+        if group not in self.groups:
+            self.groups[group] = CancellationToken()
+        return self.groups[group]
+
+    def restart(self, group: str) -> CancellationToken:
+        """Cancel all work in group and return a fresh token for the work replacing it."""
+        self.cancel(group)
+        self.groups[group] = CancellationToken()
+        return self.groups[group]
+
+    def cancel(self, group: str):
+        token = self.groups.pop(group, None)
+        if token is None:
+            return
+
+        token.cancel()
+        for task in [task for task in self.tasks if task.token is token]:
+            if task.pool.tryTake(task):
+                self.tasks.discard(task)
+
+    def shutdown(self):
+        for group in list(self.groups):
+            self.cancel(group)
+        for pool in self.pools.values():
+            pool.clear()
+        for pool in self.pools.values():
+            pool.waitForDone()
+
+    @Slot(object, object)
+    def _task_finished(self, task: _Task, result):
+        self.tasks.discard(task)
+        if task.token.cancelled or task.on_result is None:
+            return
+        task.on_result(result)
+
+    @Slot(object, object)
+    def _task_failed(self, task: _Task, error: Exception):
+        self.tasks.discard(task)
+        if task.token.cancelled or isinstance(error, TaskCancelled):
+            return
+        if task.on_error is not None:
+            task.on_error(error)
+        else:
+            print(f"error in background task {getattr(task.fn, '__name__', task.fn)}: {error}")
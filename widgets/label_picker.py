@@ -1,4 +1,4 @@
-from threading import Thread
+import os
 
 from PySide6.QtCore import Qt, Signal, Slot
 from PySide6.QtWidgets import (
@@ -11,24 +11,50 @@ from PySide6.QtWidgets import (
     QProgressBar,
 )
 
+from library import LibraryIndex, scan
+from task_scheduler import TaskScheduler
 from youtube_8m import YouTube8mClient
 
+# Local videos are added to the gallery this many at a time, as tags are ten URLs at a time
+LIBRARY_PAGE_SIZE = 100
+
 
 class LabelPicker(QWidget):
     urls_ready = Signal(list)
+    videos_ready = Signal(list)
     fetching_urls = Signal(str)
     labels_fetched = Signal()
-
-    def __init__(self, yt8m_client: YouTube8mClient, *args, **kwargs):
+    labels_failed = Signal()
+
+    def __init__(
+        self,
+        yt8m_client: YouTube8mClient,
+        task_scheduler: TaskScheduler,
+        library: LibraryIndex,
+        *args,
+        **kwargs,
+    ):
         QWidget.__init__(self, *args, **kwargs)
 
         self.yt8m_client = yt8m_client
+        self.task_scheduler = task_scheduler
+        self.library = library
         self.tag = ""
+        self.labels_ready = False
+        self.submit_pending = False
+        # The last scanned folder, its videos and how many of them the gallery has been given
+        self.library_folder = None
+        self.library_videos = []
+        self.library_offset = 0
 
         self.completer = QCompleter([])
         self.completer.setCaseSensitivity(Qt.CaseInsensitive)
         self.label_picker = QLineEdit()
-        self.label_picker.setPlaceholderText("category/url")
+        self.label_picker.setPlaceholderText("category/url/folder")
+        if self.yt8m_client.tag_index_folder is not None:
+            self.label_picker.setPlaceholderText(
+                "category/url/folder/query, e.g. Car & Snow - Truck"
+            )
         self.label_picker.setCompleter(self.completer)
         self.submit_button = QPushButton("submit")
 
@@ -49,14 +75,30 @@ class LabelPicker(QWidget):
         self.submit_button.clicked.connect(self.submit_label)
         self.labels_fetched.connect(self._show_popup_if_text_entered)
 
-        self.fetch_thread = Thread(target=self._fetch_labels)
-        self.fetch_thread.start()
-
-    def _fetch_labels(self):
+    def fetch_labels(self):
+        # Not called from __init__, so that no network I/O happens before the window is shown
         self.loading.show()
-        self.yt8m_client.fetch_labels()
+        self.task_scheduler.submit(
+            self.yt8m_client.fetch_labels,
+            on_result=self._labels_fetched,
+            on_error=self._labels_fetch_failed,
+        )
+
+    def _labels_fetched(self, _labels):
+        self.labels_ready = True
+        self.loading.hide()
         self.labels_fetched.emit()
+
+        if self.submit_pending:
+            self.submit_pending = False
+            self.submit_label()
+
+    def _labels_fetch_failed(self, error: Exception):
+        print(f"unable to download labels: {error}")
+        self.labels_ready = True
+        self.submit_pending = False
         self.loading.hide()
+        self.labels_failed.emit()
 
     def _show_popup_if_text_entered(self):
         self.label_picker.completer().model().setStringList(self.yt8m_client.labels)
@@ -64,8 +106,6 @@ class LabelPicker(QWidget):
             self.label_picker.completer().complete()
 
     def fetch_next_ten_urls_for_tag(self, tag=None):
-        self.loading.show()
-
         if tag is None:
             if self.tag:
                 tag = self.tag
@@ -74,30 +114,118 @@ class LabelPicker(QWidget):
         else:
             self.tag = tag
 
+        self.loading.show()
         self.fetching_urls.emit(tag)
-        urls = self.yt8m_client.fetch_next_ten_urls_for_tag(tag)
-        self.urls_ready.emit(urls)
+
+        # A new tag supersedes any lookup still running for the previous one
+        token = self.task_scheduler.restart("urls")
+        self.task_scheduler.submit(
+            self.yt8m_client.fetch_next_ten_urls_for_tag,
+            tag,
+            token,
+            token=token,
+            on_result=self.urls_ready.emit,
+            on_error=lambda e: self._urls_fetch_failed(tag, e),
+        )
+
+    def fetch_next_ten_urls_for_query(self, expression):
+        self.tag = ""
+        self.loading.show()
+        self.fetching_urls.emit(expression)
+
+        token = self.task_scheduler.restart("urls")
+        self.task_scheduler.submit(
+            self.yt8m_client.fetch_next_ten_urls_for_query,
+            expression,
+            token,
+            token=token,
+            on_result=self.urls_ready.emit,
+            on_error=lambda e: self._urls_fetch_failed(expression, e),
+        )
+
+    def scan_library(self, folder):
+        self.tag = ""
+        self.loading.show()
+        self.fetching_urls.emit(folder)
+
+        # Submitting the same folder again shows its next page, as with tags
+        if folder == self.library_folder:
+            self._emit_library_page()
+            return
+
+        self.library_folder = None
+        token = self.task_scheduler.restart("urls")
+        self.task_scheduler.submit(
+            scan,
+            self.library,
+            folder,
+            os.cpu_count(),
+            token,
+            token=token,
+            on_result=lambda videos: self._library_scanned(folder, videos),
+            on_error=lambda e: self._library_scan_failed(folder, e),
+            pool="jobs",
+        )
+
+    def _library_scanned(self, folder, videos):
+        self.library_folder = folder
+        self.library_videos = videos
+        self.library_offset = 0
+        self._emit_library_page()
+
+    def _emit_library_page(self):
+        page = self.library_videos[self.library_offset : self.library_offset + LIBRARY_PAGE_SIZE]
+        if not page:
+            print(f"no more videos in {self.library_folder}")
+        self.library_offset += len(page)
+        self.videos_ready.emit(page)
+
+    def _library_scan_failed(self, folder, error: Exception):
+        print(f"unable to scan {folder}: {error}")
+        self.loading.hide()
+
+    def _urls_fetch_failed(self, label, error: Exception):
+        print(f"unable to fetch videos for {label}: {error}")
+        self.loading.hide()
 
     @Slot()
     def check_labels_fetched(self):
-        if self.fetch_thread.is_alive():
+        if not self.labels_ready:
             return
 
         if self.completer is None:
             self.label_picker.completer().model().setStringList(self.yt8m_client.labels)
 
+    def _is_query(self, label):
+        if self.yt8m_client.tag_index_folder is None:
+            return False
+
+        # Imported here, tag_index pulls in numpy
+        from tag_index import is_query
+
+        return is_query(label)
+
     @Slot()
     def submit_label(self):
-        if self.fetch_thread.is_alive():
-            self.fetch_thread.join()
-
         label = self.label_picker.text()
+        if label != self.library_folder:
+            # Anything else clears the gallery, so the folder starts over from its first page
+            self.library_folder = None
         if label in self.yt8m_client.labels:
             tag = self.yt8m_client.labels[label][0]
-            self.fetch_thread = Thread(target=self.fetch_next_ten_urls_for_tag, args=(tag,))
-            self.fetch_thread.start()
+            self.fetch_next_ten_urls_for_tag(tag)
+        elif os.path.isdir(os.path.expanduser(label)):
+            self.scan_library(label)
+        elif self._is_query(label):
+            if not self.labels_ready:
+                self.submit_pending = True
+            else:
+                self.fetch_next_ten_urls_for_query(label)
         elif "https://www.youtube.com/watch" in label:
             self.fetching_urls.emit(None)
             self.urls_ready.emit([label])
+        elif not self.labels_ready:
+            # Submitted before the label list arrived; try again once it has
+            self.submit_pending = True
         else:
             print("not a valid label")
@@ -1,31 +1,64 @@
-import random
-import time
-import os
-from typing import List
-from concurrent.futures import ThreadPoolExecutor
-from threading import Thread
-import requests
+from typing import List, Optional, TYPE_CHECKING
 
 from PySide6.QtCore import QSize, Qt, Signal, Slot
-from PySide6.QtGui import QPixmap, QResizeEvent, QIcon
+from PySide6.QtGui import QImage, QPixmap, QResizeEvent, QIcon
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton
 
-from pytube import YouTube
+from streams import StreamManifestCache
+from task_scheduler import Priority, TaskScheduler
+
+if TYPE_CHECKING:
+    from library import LibraryIndex, VideoInfo
 
 THUMBNAIL_WIDTH_PX = 8 * 16
 THUMBNAIL_HEIGHT_PX = 8 * 9
 THUMBNAIL_MARGIN_PX = 5
+# 320x180, the smallest of YouTube's thumbnails without black bars above and below
+THUMBNAIL_TEMPLATE_URL = "https://i.ytimg.com/vi/{}/mqdefault.jpg"
+YOUTUBE_LOGO_FNAME = "yt_logo.jpg"
+
+
+class ThumbnailRecord(object):
+    """
+    A video in the gallery: its thumbnail, already scaled to display size, and the URL (or local
+    path) it is opened from.  The video's streams are only resolved once it is clicked (or
+    prefetched).
+    """
+
+    __slots__ = ("video_id", "url", "pixmap", "tooltip")
+
+    def __init__(self, video_id: str, url: str, pixmap: QPixmap, tooltip: Optional[str] = None):
+        self.video_id = video_id
+        self.url = url
+        self.pixmap = pixmap
+        self.tooltip = tooltip
+
+    @property
+    def nbytes(self) -> int:
+        return self.pixmap.width() * self.pixmap.height() * self.pixmap.depth() // 8
 
 
 class ThumbnailGallery(QWidget):
-    video_selected = Signal(YouTube)
+    video_selected = Signal(str)
     thumbnails_ready = Signal()
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        task_scheduler: TaskScheduler,
+        manifest_cache: StreamManifestCache,
+        library: "LibraryIndex",
+        *args,
+        max_thumbnail_bytes: int = 32 * 1024 * 1024,
+        **kwargs,
+    ):
         QWidget.__init__(self, *args, **kwargs)
 
+        self.task_scheduler = task_scheduler
+        self.manifest_cache = manifest_cache
+        self.library = library
+        self.max_thumbnail_bytes = max_thumbnail_bytes
         self.current_tag = ""
-        self.busy = False
+        self.pending = 0
 
         self.vertical_layout = QVBoxLayout(self)
         self.vertical_layout.setSpacing(THUMBNAIL_MARGIN_PX)
@@ -34,15 +67,13 @@ class ThumbnailGallery(QWidget):
         )
         self.vertical_layout.setAlignment(Qt.AlignHCenter | Qt.AlignTop)
         self.setLayout(self.vertical_layout)
-        self.thumbnails = []
+        self.thumbnails: List[ThumbnailRecord] = []
+        self.thumbnail_bytes = 0
         self.num_columns = 1
+        self.last_row = None
 
         self.render_thumbnails()
 
-        random.seed(int(time.time()))
-
-        self.thumbnails_ready.connect(self.render_thumbnails)
-
     @Slot()
     def render_thumbnails(self, columns=None):
         if columns == self.num_columns:
@@ -54,48 +85,158 @@ class ThumbnailGallery(QWidget):
         while item := self.vertical_layout.takeAt(0):
             w = item.widget()
             w.hide()
+            # Rows stay children of the gallery until deleted, along with their thumbnails
+            w.deleteLater()
             del w, item
+        self.last_row = None
 
-        for i, (pixmap, yt) in enumerate(self.thumbnails):
-            thumbnail = Thumbnail(pixmap, yt)
-            # yt=thumbnail.yt is a hack to prevent yt from referring to the last yt value
-            thumbnail.clicked.connect(lambda *_, yt=thumbnail.yt: self.video_selected.emit(yt))
+        for i, record in enumerate(self.thumbnails):
+            self._add_thumbnail_widget(i, record)
 
-            if i % self.num_columns == 0:
-                row = ThumbnailRow()
-                self.vertical_layout.addWidget(row)
-            row.add_thumbnail(thumbnail)
+    def _add_thumbnail_widget(self, i: int, record: ThumbnailRecord) -> None:
+        thumbnail = Thumbnail(record.pixmap)
+        if record.tooltip:
+            thumbnail.setToolTip(record.tooltip)
+        # url=record.url is a hack to prevent url from referring to the last record
+        thumbnail.clicked.connect(lambda *_, url=record.url: self.video_selected.emit(url))
 
-    def _add_thumbnails_from_urls(self, urls: List[str]) -> None:
-        youtubes = [YouTube(url) for url in urls]
-        with ThreadPoolExecutor(max_workers=min(10, len(urls))) as p:
-            thumbnail_imgs = p.map(self._download_thumbnail, youtubes)
-
-        self.thumbnails.extend(list(zip(thumbnail_imgs, youtubes)))
-        self.thumbnails_ready.emit()
+        if i % self.num_columns == 0:
+            self.last_row = ThumbnailRow()
+            self.vertical_layout.addWidget(self.last_row)
+        self.last_row.add_thumbnail(thumbnail)
 
     def add_thumbnails_from_urls(self, urls: List[str]) -> None:
-        t = Thread(target=self._add_thumbnails_from_urls, args=(urls,))
-        t.start()
+        if not urls:
+            self.thumbnails_ready.emit()
+            return
 
-    def _download_thumbnail(self, yt: YouTube) -> QPixmap:
-        url = yt.thumbnail_url
+        scale, size = self._thumbnail_size()
+        token = self.task_scheduler.token("thumbnails")
+        self.pending += len(urls)
+        for url in urls:
+            self.task_scheduler.submit(
+                self._download_thumbnail,
+                url,
+                size,
+                token=token,
+                on_result=lambda result, scale=scale: self._thumbnail_downloaded(result, scale),
+                on_error=self._thumbnail_failed,
+            )
+
+    def add_local_videos(self, videos: List["VideoInfo"]) -> None:
+        if not videos:
+            self.thumbnails_ready.emit()
+            return
 
-        YOUTUBE_LOGO_FNAME = "yt_logo.jpg"
+        scale, size = self._thumbnail_size()
+        token = self.task_scheduler.token("thumbnails")
+        self.pending += len(videos)
+        for video in videos:
+            self.task_scheduler.submit(
+                self._read_local_thumbnail,
+                video,
+                size,
+                token=token,
+                on_result=lambda result, scale=scale: self._add_thumbnail(result, scale),
+                on_error=self._thumbnail_failed,
+            )
+
+    def _thumbnail_size(self):
+        # Scaled on the worker, to the screen's pixels so they stay sharp on high DPI displays
+        scale = self.devicePixelRatioF()
+        return scale, QSize(round(THUMBNAIL_WIDTH_PX * scale), round(THUMBNAIL_HEIGHT_PX * scale))
+
+    def _read_local_thumbnail(self, video: "VideoInfo", size: QSize):
+        data = self.library.thumbnail(video.path)
+        if data:
+            image = QImage.fromData(data).scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        else:
+            # The video could not be read when it was scanned
+            image = QImage(size, QImage.Format_RGB32)
+            image.fill(Qt.darkGray)
+
+        seconds = round(video.duration_ms / 1000)
+        tooltip = video.path
+        if video.width and video.fps:
+            tooltip += (
+                f"\n{video.width}x{video.height}, {video.fps:.2f} fps, "
+                f"{seconds // 60}:{seconds % 60:02}"
+            )
+        return video.video_id, video.path, image, tooltip
+
+    def _download_thumbnail(self, url: str, size: QSize):
+        # Runs on a worker thread, where QPixmap must not be used; QImage is safe
+        import requests
+        from pytube.extract import video_id as extract_video_id
+
+        video_id = extract_video_id(url)
         try:
-            r = requests.get(url)
-            # TODO: this will collide in rare instances.  Try to find a more deterministic name.
-            fname = f"{random.randint(100_000, 999_999)}.jpg"
-            open(fname, "wb").write(r.content)
-            pix = QPixmap(fname)
-            os.remove(fname)
+            r = requests.get(THUMBNAIL_TEMPLATE_URL.format(video_id), timeout=5)
+            r.raise_for_status()
+            image = QImage.fromData(r.content)
         except Exception as e:
-            print(f"error retrieving video: {e}")
-            pix = QPixmap(YOUTUBE_LOGO_FNAME)
-        return pix
+            print(f"error retrieving thumbnail for {url}: {e}")
+            image = QImage(YOUTUBE_LOGO_FNAME)
+        image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return video_id, url, image, None
+
+    def _add_thumbnail(self, result, scale: float) -> None:
+        video_id, url, image, tooltip = result
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(scale)
+        record = ThumbnailRecord(video_id, url, pixmap, tooltip)
+
+        self.thumbnails.append(record)
+        self.thumbnail_bytes += record.nbytes
+        if self._evict_thumbnails():
+            self.render_thumbnails()
+        else:
+            self._add_thumbnail_widget(len(self.thumbnails) - 1, record)
+        self._thumbnail_finished()
+
+    def _thumbnail_downloaded(self, result, scale: float) -> None:
+        self._add_thumbnail(result, scale)
+        url = result[1]
+
+        # Resolve the video's streams ahead of a click, on a pool of its own so it does not hold
+        # up the remaining thumbnails
+        self.task_scheduler.submit(
+            self.manifest_cache.resolve,
+            url,
+            token=self.task_scheduler.token("thumbnails"),
+            priority=Priority.LOW,
+            on_error=lambda e: None,  # Reported again if the video is opened
+            pool="manifests",
+        )
+
+    def _evict_thumbnails(self) -> bool:
+        """
+        Once over the memory budget, drop the oldest thumbnails down to 3/4 of it, so that a long
+        list (e.g. a large local library) is not re-rendered for every thumbnail added.  Returns
+        whether any were dropped.
+        """
+        if self.thumbnail_bytes <= self.max_thumbnail_bytes:
+            return False
+
+        while self.thumbnail_bytes > 3 * self.max_thumbnail_bytes // 4 and len(self.thumbnails) > 1:
+            self.thumbnail_bytes -= self.thumbnails.pop(0).nbytes
+        return True
+
+    def _thumbnail_failed(self, error: Exception) -> None:
+        print(f"error retrieving thumbnail: {error}")
+        self._thumbnail_finished()
+
+    def _thumbnail_finished(self) -> None:
+        self.pending -= 1
+        if self.pending == 0:
+            self.thumbnails_ready.emit()
 
     def clear_thumbnails(self):
+        # Thumbnails still downloading for the previous tag are no longer wanted
+        self.task_scheduler.restart("thumbnails")
+        self.pending = 0
         self.thumbnails = []
+        self.thumbnail_bytes = 0
         self.render_thumbnails()
 
     def begin_loading_tag(self, tag: str):
@@ -122,16 +263,14 @@ class ThumbnailGallery(QWidget):
 
 
 class Thumbnail(QPushButton):
-    def __init__(self, pixmap: QPixmap, yt: YouTube, *args, **kwargs):
+    def __init__(self, pixmap: QPixmap, *args, **kwargs):
         QPushButton.__init__(self, *args, **kwargs)
 
-        self.yt = yt
-
         icon = QIcon(pixmap)
         self.setIcon(icon)
         self.setFlat(True)
-        # Set the icon bigger than the button, and it will be downscaled to exactly the right size
-        self.setIconSize(QSize(2 * THUMBNAIL_WIDTH_PX, 2 * THUMBNAIL_HEIGHT_PX))
+        # The pixmap is already display size, so it is painted without scaling
+        self.setIconSize(QSize(THUMBNAIL_WIDTH_PX, THUMBNAIL_HEIGHT_PX))
         self.setFixedSize(QSize(THUMBNAIL_WIDTH_PX, THUMBNAIL_HEIGHT_PX))
 
 
@@ -1,13 +1,12 @@
+import bisect
 import os
-import pwd
-from termios import ECHOE
-import time
-from threading import Thread
 import math
+import time
+from typing import List
 
 from PySide6.QtMultimedia import QMediaPlayer
 from PySide6.QtMultimediaWidgets import QGraphicsVideoItem
-from PySide6.QtCore import Qt, Signal, Slot, QUrl, QSize, QTimer
+from PySide6.QtCore import Qt, Signal, Slot, QUrl, QSize, QTimer, QRectF
 from PySide6.QtGui import QPainter, QResizeEvent, QKeyEvent, QIcon, QMouseEvent, QColor, QFont
 from PySide6.QtWidgets import (
     QGraphicsRectItem,
@@ -29,27 +28,67 @@ from PySide6.QtWidgets import (
     QGraphicsScene,
 )
 
-import cv2
-import yaml
-from pytube import YouTube
+from dataset import OUTPUT_WRITERS, YoloBox, load_label_names
+from exporter import Mark, export_marks
+from library import local_video_id
+from prelabel import Prelabeler, Proposal
+from sessions import AnnotationSession
+from streams import (
+    PLAYBACK_HEIGHTS,
+    ResolutionPolicy,
+    StreamManifestCache,
+    download_stream,
+    read_frame,
+)
+from task_scheduler import CancellationToken, Priority, TaskScheduler
 
 
 FNAME_PREFIX = "yt_download_"
+# Spacing of the frames detected when pre-labeling a whole video
+PRELABEL_INTERVAL_MS = 1000
+# The slider is moved at most this often during playback
+PLAYHEAD_INTERVAL_S = 0.1
+# Crosshairs follow the mouse at most this often
+CROSSHAIRS_INTERVAL_MS = 16
 
 
 def sigmoid(x):
     return 1 / (1 + math.exp(-x))
 
 
+def label_color(label: str) -> QColor:
+    """A bright color that is always the same for the same label."""
+    r = sigmoid(hash(label) / (1 << 63)) * 255
+    g = sigmoid(hash(label[1:] + label[0]) / (1 << 63)) * 255
+    b = sigmoid(hash(label[2:] + label[0:2]) / (1 << 63)) * 255
+    brightness = math.sqrt(r * r + g * g + b * b)
+    return QColor(r / brightness * 255, g / brightness * 255, b / brightness * 255, 255)
+
+
 class VideoPlayer(QWidget):
+    download_started = Signal(int)
     file_size_changed = Signal(int)
-    video_downloaded = Signal(str)
-
-    def __init__(self, *args, **kwargs):
+    export_progress = Signal(int, int)
+    prelabel_progress = Signal(int, int)
+
+    def __init__(
+        self,
+        task_scheduler: TaskScheduler,
+        manifest_cache: StreamManifestCache,
+        *args,
+        **kwargs,
+    ):
         QWidget.__init__(self, *args, **kwargs)
 
+        self.task_scheduler = task_scheduler
+        self.manifest_cache = manifest_cache
         self.custom_data_yaml_file = None
         self.output_folder = None
+        self.output_writer = None
+        self.resolution_policy = ResolutionPolicy()
+        self.prelabeler = None
+        # A loaded model that is still being checked
+        self.pending_prelabeler = None
 
         # Theme names from here:
         # https://specifications.freedesktop.org/icon-naming-spec/icon-naming-spec-latest.html
@@ -57,10 +96,33 @@ class VideoPlayer(QWidget):
             QIcon.fromTheme("system-file-manager"), "load labels file"
         )
         self.label_selector = QComboBox()
+        self.playback_resolution_selector = QComboBox()
+        self.playback_resolution_selector.addItems([f"{h}p" for h in PLAYBACK_HEIGHTS])
+        self.playback_resolution_selector.setCurrentText(
+            f"{self.resolution_policy.playback_max_height}p"
+        )
+        self.playback_resolution_selector.setToolTip(
+            "resolution downloaded for playback; frames are saved at full resolution"
+        )
         self.open_folder_button = QPushButton(
             QIcon.fromTheme("system-file-manager"), "load output folder"
         )
+        self.output_format_selector = QComboBox()
+        self.output_format_selector.addItems(list(OUTPUT_WRITERS))
+        self.output_format_selector.setToolTip(
+            "files: one .png and .txt per frame\nshards: indexed tar shards, appended to"
+        )
         self.save_button = QPushButton(QIcon.fromTheme("document-save"), "save bounding boxes")
+        self.mark_button = QPushButton(QIcon.fromTheme("bookmark-new"), "mark frame")
+        self.export_button = QPushButton(QIcon.fromTheme("document-save-as"), "export 0 marks")
+        self.export_button.setEnabled(False)
+        self.load_model_button = QPushButton(QIcon.fromTheme("document-open"), "load model")
+        self.load_model_button.setToolTip("ONNX detector whose classes are the labels file's names")
+        self.prelabel_button = QPushButton(QIcon.fromTheme("system-run"), "pre-label")
+        self.prelabel_button.setToolTip(
+            f"detect a frame every {PRELABEL_INTERVAL_MS / 1000:g} s of the video in the background"
+        )
+        self.prelabel_button.setEnabled(False)
         self.help_button = QPushButton(QIcon.fromTheme("help-about"), "help")
         self.video_window = VideoWindow()
         self.seek_backward_button = QPushButton(QIcon.fromTheme("media-seek-backward"), "")
@@ -78,7 +140,13 @@ class VideoPlayer(QWidget):
         self.menu_bar.addWidget(self.load_labels_button)
         self.menu_bar.addWidget(self.label_selector)
         self.menu_bar.addStretch()
+        self.menu_bar.addWidget(self.playback_resolution_selector)
+        self.menu_bar.addWidget(self.output_format_selector)
         self.menu_bar.addWidget(self.save_button)
+        self.menu_bar.addWidget(self.mark_button)
+        self.menu_bar.addWidget(self.export_button)
+        self.menu_bar.addWidget(self.load_model_button)
+        self.menu_bar.addWidget(self.prelabel_button)
         self.menu_bar.addWidget(self.help_button)
         self.playhead_layout = QHBoxLayout()
         self.playhead_layout.addWidget(self.seek_backward_button)
@@ -92,25 +160,31 @@ class VideoPlayer(QWidget):
         self.main_layout.addWidget(self.loading)
         self.setLayout(self.main_layout)
 
-        self.timer = QTimer()
-        self.timer.setInterval(15)
-        self.timer.start()
-
         self.yaml_dialog = QFileDialog(filter="YAML files (*.yaml *.yml)")
+        self.model_dialog = QFileDialog(filter="ONNX models (*.onnx)")
         self.help_dialog = QMessageBox(
             text="""j: back 10s
 k/SPACE: play/pause
 l: forward 10s
 <: back 1 frame
 >: forward 1 frame
+m: mark frame for export
+p: propose boxes with the loaded model
+[/]: previous/next pre-labeled frame
 
 Left-click to place a bounding box
 Right-click to remove a bounding box"""
         )
 
-        self.timer.timeout.connect(self._update_playhead)
+        # Position updates only arrive while the video plays or seeks, so nothing runs when paused
+        self.video_window.media_player.positionChanged.connect(self._update_playhead)
+        self.video_window.media_player.durationChanged.connect(self._update_playhead)
+        self.video_window.media_player.playbackStateChanged.connect(self._update_playhead)
+        self.last_playhead_update = 0.0
+        self.download_started.connect(self._download_started)
         self.file_size_changed.connect(self._file_size_change)
-        self.video_downloaded.connect(self.set_video_source)
+        self.export_progress.connect(self._show_progress)
+        self.prelabel_progress.connect(self._show_progress)
         self.slider.sliderMoved.connect(self._jump_to_position)
         self.seek_backward_button.clicked.connect(self.seek_backward)
         self.play_button.clicked.connect(self.pause_play)
@@ -118,10 +192,22 @@ Right-click to remove a bounding box"""
         self.load_labels_button.clicked.connect(self.yaml_dialog.show)
         self.yaml_dialog.fileSelected.connect(self.load_labels_file)
         self.label_selector.currentTextChanged.connect(self.set_current_label)
+        self.playback_resolution_selector.currentTextChanged.connect(self.set_playback_resolution)
+        self.output_format_selector.currentTextChanged.connect(self.close_output_writer)
         self.help_button.clicked.connect(self.help_dialog.show)
         self.save_button.clicked.connect(self.save_bounding_boxes)
+        self.mark_button.clicked.connect(self.mark_frame)
+        self.export_button.clicked.connect(self.export_marks)
+        self.load_model_button.clicked.connect(self.model_dialog.show)
+        self.model_dialog.fileSelected.connect(self.load_model)
+        self.prelabel_button.clicked.connect(self.prelabel_video)
 
         self.current_video = None
+        self.current_url = None
+        # Marked frames waiting to be exported, per video id
+        self.marks = {}
+        # Boxes added from proposals and not removed since, replaced by the next proposals
+        self.proposed_boxes = []
 
     @Slot()
     def set_current_label(self, label):
@@ -130,57 +216,306 @@ Right-click to remove a bounding box"""
                 self.video_window.scene.current_label = label
                 break
 
+    @Slot()
+    def set_playback_resolution(self, text):
+        # Applies to the next video that is loaded
+        self.resolution_policy.playback_max_height = int(text.replace("p", ""))
+
     @Slot()
     def load_labels_file(self, fname):
         self.custom_data_yaml_file = fname
-        custom_data = None
-        with open(fname, "r") as f:
-            custom_data = yaml.safe_load(f)
-        if custom_data is not None and "names" in custom_data:
+        names = load_label_names(fname)
+        if names:
             self.label_selector.clear()
-            self.label_selector.addItems(custom_data["names"])
+            self.label_selector.addItems(names)
+
+    def _labels(self):
+        labels = []
+        for i in range(self.label_selector.count()):
+            labels.append(self.label_selector.itemText(i))
+        return labels
+
+    def _ensure_output_folder(self):
+        if self.output_folder is None:
+            self.output_folder = str(QFileDialog.getExistingDirectory(self, "Select Output Folder"))
+
+    def _ensure_output_writer(self):
+        self._ensure_output_folder()
+        if self.output_writer is None:
+            writer_type = OUTPUT_WRITERS[self.output_format_selector.currentText()]
+            self.output_writer = writer_type(self.output_folder)
+        return self.output_writer
+
+    @Slot()
+    def close_output_writer(self):
+        if self.output_writer is not None:
+            self.output_writer.close()
+            self.output_writer = None
 
     @Slot()
     def save_bounding_boxes(self):
         if self.current_video is None:
             return
 
-        if self.output_folder is None:
-            self.output_folder = str(QFileDialog.getExistingDirectory(self, "Select Output Folder"))
+        writer = self._ensure_output_writer()
+
+        # Snapshot everything the worker needs, the user may keep drawing or seeking meanwhile
+        labels = self._labels()
+        mark = Mark(self.video_window.position, self.video_window.scene.yolo_boxes(labels))
+        stem = mark.stem(self.current_video)
+        self._record_mark(mark, labels)
+        self.task_scheduler.submit(
+            self._save_frame,
+            self.current_url,
+            self.video_window.fname,
+            mark,
+            writer,
+            stem,
+            on_error=lambda e: print(f"error saving {stem}: {e}"),
+        )
 
-        labels = []
-        for i in range(self.label_selector.count()):
-            labels.append(self.label_selector.itemText(i))
+    def _save_frame(self, url: str, local_fname: str, mark: Mark, writer, stem: str):
+        # Boxes are normalized to the frame, and every stream of a video covers the same picture,
+        # so they apply unchanged to a frame of any resolution
+        image = None
+        # Local videos are played back at full resolution already
+        if url is not None and not os.path.exists(url):
+            try:
+                # Goes through the cache in case the signed URLs have expired since loading
+                video = self.manifest_cache.resolve(url)
+                stream = self.resolution_policy.export_stream(video.streams)
+                if stream is not None:
+                    image = read_frame(stream.url, mark.position_ms)
+                    if image is None:
+                        print(f"unable to decode {stem} at full resolution, using playback stream")
+            except Exception as e:
+                print(f"unable to read full resolution frame, using playback stream:\n    {e}")
+        if image is None:
+            image = read_frame(local_fname, mark.position_ms)
+
+        writer.write(stem, image, mark.boxes)
 
-        video = cv2.VideoCapture(self.video_window.fname)
-        video.set(cv2.CAP_PROP_POS_MSEC, self.video_window.position)
-        success, image = video.read()
-        fname = f"{self.output_folder}/{self.current_video}_{self.video_window.position}"
-        if success:
-            cv2.imwrite(fname + ".png", image)
-        with open(fname + ".txt", "w") as f:
-            frame_width, frame_height = (
-                self.video_window.scene.items()[-1].boundingRect().width(),
-                self.video_window.scene.items()[-1].boundingRect().height(),
-            )
-            frame_x_offset, frame_y_offset = (
-                self.video_window.scene.items()[-1].boundingRect().x(),
-                self.video_window.scene.items()[-1].boundingRect().y(),
-            )
-            for label in self.video_window.scene.rectangles:
-                label_id = -1
-                if label in labels:
-                    label_id = labels.index(label)
-                else:
-                    continue
-                for rect in self.video_window.scene.rectangles[label]:
-                    x = (2 * rect.rect().x() + rect.rect().width()) / 2 - frame_x_offset
-                    x /= frame_width
-                    y = (2 * rect.rect().y() + rect.rect().height()) / 2 - frame_y_offset
-                    y /= frame_height
-                    w = abs(rect.rect().width() / frame_width)
-                    h = abs(rect.rect().height() / frame_height)
-                    f.writelines([f"{label_id} {x} {y} {w} {h}\n"])
+    @Slot()
+    def mark_frame(self):
+        if self.current_video is None:
+            return
+
+        self._ensure_output_folder()
+
+        labels = self._labels()
+        mark = Mark(self.video_window.position, self.video_window.scene.yolo_boxes(labels))
+        marks = self.marks.setdefault(self.current_video, [])
+        # Marking the same frame again replaces its boxes
+        marks[:] = [m for m in marks if m.position_ms != mark.position_ms]
+        marks.append(mark)
+        self._update_export_button()
+        self._record_mark(mark, labels)
+
+    def _record_mark(self, mark: Mark, labels):
+        # Recorded in the video's session, for exporting again later with export_dataset.py
+        session_fname = AnnotationSession.path(self.output_folder, self.current_video)
+        if os.path.exists(session_fname):
+            session = AnnotationSession.load(session_fname)
+        else:
+            session = AnnotationSession(self.current_video, self.current_url)
+        session.add_mark(mark, labels)
+        session.save(session_fname)
+
+    def _update_export_button(self):
+        count = len(self.marks.get(self.current_video, []))
+        self.export_button.setText(f"export {count} mark{'' if count == 1 else 's'}")
+        self.export_button.setEnabled(count > 0)
+
+    @Slot()
+    def export_marks(self):
+        marks = self.marks.pop(self.current_video, [])
+        if not marks:
+            return
+
+        writer = self._ensure_output_writer()
+        self._update_export_button()
+
+        self.loading.setRange(0, len(marks))
+        self.loading.setValue(0)
+        self.loading.show()
+        self.task_scheduler.submit(
+            self._export_marks,
+            self.current_url,
+            self.video_window.fname,
+            self.current_video,
+            marks,
+            writer,
+            on_result=lambda count: self.loading.hide(),
+            on_error=lambda e, video_id=self.current_video, marks=marks: self._export_failed(
+                video_id, marks, e
+            ),
+            pool="jobs",
+        )
+
+    def _export_marks(self, url: str, local_fname: str, video_id: str, marks, writer):
+        on_progress = self.export_progress.emit
+
+        source = local_fname
+        if url is not None and not os.path.exists(url):
+            try:
+                video = self.manifest_cache.resolve(url)
+                stream = self.resolution_policy.export_stream(video.streams)
+                if stream is not None:
+                    source = stream.url
+            except Exception as e:
+                print(f"unable to export at full resolution, using playback stream:\n    {e}")
+        # Errors exporting are not retried from the playback stream: that would overwrite frames
+        # already written at full resolution.  They reach _export_failed, which keeps the marks.
+        return export_marks(source, marks, writer, video_id, on_progress=on_progress)
+
+    def _export_failed(self, video_id: str, marks, error: Exception):
+        print(f"error exporting marks for {video_id}: {error}")
+        self.loading.hide()
+        # Keep the marks so the export can be retried
+        self.marks.setdefault(video_id, []).extend(marks)
+        self._update_export_button()
+
+    @Slot()
+    def load_model(self, fname):
+        self.close_prelabeler()
+        try:
+            prelabeler = Prelabeler(fname)
+        except OSError as e:
+            print(f"unable to load {fname}: {e}")
+            return
+
+        # Only used once the model has been seen to work
+        self.pending_prelabeler = prelabeler
+        token = self.task_scheduler.restart("model")
+        self.task_scheduler.submit(
+            prelabeler.check,
+            token=token,
+            on_result=lambda _: self._model_loaded(prelabeler),
+            on_error=lambda e: self._model_load_failed(prelabeler, fname, e),
+            pool="jobs",
+        )
+
+    def _model_loaded(self, prelabeler: Prelabeler):
+        self.pending_prelabeler = None
+        self.prelabeler = prelabeler
+        self.prelabel_button.setEnabled(True)
+
+    def _model_load_failed(self, prelabeler: Prelabeler, fname: str, error: Exception):
+        # A model that fails to load takes the worker process down with it
+        print(f"unable to load {fname}: {error or type(error).__name__}")
+        self.pending_prelabeler = None
+        prelabeler.close()
+
+    @Slot()
+    def close_prelabeler(self):
+        self.task_scheduler.cancel("model")
+        if self.pending_prelabeler is not None:
+            self.pending_prelabeler.close()
+            self.pending_prelabeler = None
+        if self.prelabeler is not None:
+            self.task_scheduler.cancel("prelabel")
+            self.prelabeler.close()
+            self.prelabeler = None
+            self.prelabel_button.setEnabled(False)
+
+    def propose_boxes(self):
+        if self.current_video is None:
+            return
+        if self.prelabeler is None:
+            print("load a detection model to propose boxes")
+            return
+
+        position = self.video_window.position
+        cached = self.prelabeler.cache.get(self.current_video, position)
+        if cached is not None:
+            self.show_proposals(cached)
+            return
+
+        token = self.task_scheduler.restart("proposals")
+        self.task_scheduler.submit(
+            self.prelabeler.propose,
+            self.current_video,
+            self.video_window.fname,
+            [position],
+            token,
+            token=token,
+            priority=Priority.HIGH,
+            on_result=lambda proposals: self.show_proposals(proposals.get(position, [])),
+            on_error=lambda e: print(f"error proposing boxes: {e}"),
+        )
+
+    @Slot()
+    def prelabel_video(self):
+        if self.current_video is None or self.prelabeler is None:
+            return
+
+        positions = list(range(0, self.video_window.duration, PRELABEL_INTERVAL_MS))
+        self.loading.setRange(0, len(positions))
+        self.loading.setValue(0)
+        self.loading.show()
+
+        # Detected from the playback file: proposals are normalized to the frame, so they apply
+        # at any resolution
+        token = self.task_scheduler.restart("prelabel")
+        self.task_scheduler.submit(
+            self.prelabeler.propose,
+            self.current_video,
+            self.video_window.fname,
+            positions,
+            token,
+            self.prelabel_progress.emit,
+            token=token,
+            priority=Priority.LOW,
+            on_result=lambda proposals: self.loading.hide(),
+            on_error=self._prelabel_failed,
+            pool="jobs",
+        )
+
+    def _prelabel_failed(self, error: Exception):
+        print(f"error pre-labeling {self.current_video}: {error}")
+        self.loading.hide()
+
+    def show_proposals(self, proposals: List[Proposal]):
+        """Add proposals as boxes, labeled by their class' name in the labels file."""
+        scene = self.video_window.scene
+        for label, item in self.proposed_boxes:
+            if item in scene.rectangles.get(label, []):
+                scene.remove_box(label, item)
+        self.proposed_boxes = []
+
+        labels = self._labels()
+        if proposals and not labels:
+            print("load a labels file to name the proposed boxes")
+            return
+
+        for class_id, x, y, w, h, score in proposals:
+            if class_id >= len(labels):
+                continue
+            item = scene.add_box(labels[class_id], scene.yolo_rect(x, y, w, h))
+            item.setToolTip(f"{labels[class_id]} {score:.2f}")
+            self.proposed_boxes.append((labels[class_id], item))
+
+    def jump_to_prelabeled_frame(self, step: int):
+        """Seek to the next (step=1) or previous (step=-1) frame with cached proposals."""
+        if self.current_video is None or self.prelabeler is None:
+            return
+
+        positions = self.prelabeler.cache.positions(self.current_video)
+        current = self.video_window.position
+        if step > 0:
+            i = bisect.bisect_right(positions, current)
+        else:
+            i = bisect.bisect_left(positions, current) - 1
+        if not 0 <= i < len(positions):
+            return
+
+        self.video_window.set_position(positions[i])
+        self.show_proposals(self.prelabeler.cache.get(self.current_video, positions[i]))
+
+    @Slot()
+    def _show_progress(self, done: int, total: int):
+        self.loading.setRange(0, total)
+        self.loading.setValue(done)
 
     def pause_play(self):
         if self.video_window.paused:
@@ -206,53 +541,81 @@ Right-click to remove a bounding box"""
             self.video_window.set_position(new_pos)
 
     @Slot()
-    def _update_playhead(self):
+    def _update_playhead(self, *_):
+        # The user is dragging it
+        if self.slider.isSliderDown():
+            return
+
+        # While playing, position updates can come every frame; a few per second are plenty for
+        # the slider.  Updates while paused (seeking, or the pause itself) always go through.
+        now = time.monotonic()
+        if not self.video_window.paused and now - self.last_playhead_update < PLAYHEAD_INTERVAL_S:
+            return
+
         pos = self.video_window.position
         dur = self.video_window.duration
         playhead = int(1000 * pos / dur if dur else 0)
-        self.slider.setValue(playhead)
+        if playhead != self.slider.value():
+            self.slider.setValue(playhead)
+            self.last_playhead_update = now
 
-    def _load_video(self, yt: YouTube):
-        self.loading.show()
+    def _load_video(self, url: str, token: CancellationToken):
+        # Runs on a worker thread: widgets are only touched through queued signals
+        if os.path.exists(url):
+            # A video from the local library, played where it is
+            return url, local_video_id(url), url
 
         try:
-            audio_video_streams = yt.streams.filter(progressive=True)
+            # Usually already resolved in the background when the thumbnail was shown
+            video = self.manifest_cache.resolve(url)
+            chosen_stream = self.resolution_policy.playback_stream(video.streams)
         except Exception as e:
-            print(f"error retrieving YouTube streams for {yt.watch_url}:\n    {e}")
-            self.loading.hide()
-            return
-
-        max_resolution = 0
-        chosen_stream = None
-        for stream in audio_video_streams:
-            res = int(stream.resolution.replace("p", ""))
-            if max_resolution < res < 1440:
-                max_resolution = res
-                chosen_stream = stream
+            print(f"error retrieving YouTube streams for {url}:\n    {e}")
+            return None
 
         if chosen_stream is None:
             print("No available stream")
-            self.loading.hide()
-            return
+            return None
+
+        token.raise_if_cancelled()
 
-        self.current_video = yt.watch_url.split("=")[1]
-        fname = f"{os.getcwd()}/{FNAME_PREFIX}{self.current_video}.mp4"
+        video_id = video.video_id
+        # The resolution is part of the name so changing the playback resolution downloads again
+        fname = f"{os.getcwd()}/{FNAME_PREFIX}{video_id}_{chosen_stream.resolution}.mp4"
         if not os.path.exists(fname):
-            fsize_mb = chosen_stream.filesize_approx // (1024 * 1024)
-            self.loading.setRange(0, fsize_mb)
-            t = Thread(
-                target=chosen_stream.download,
-                kwargs={"filename": fname, "skip_existing": False},
-            )
-            t.start()
-            while t.is_alive():
-                time.sleep(0.1)
-                if os.path.exists(fname):
-                    self.file_size_changed.emit(os.path.getsize(fname) // (1024 * 1024))
-            t.join()
+            fsize = chosen_stream.filesize_approx
+            self.download_started.emit(fsize // (1024 * 1024))
+
+            def on_progress(written):
+                self.file_size_changed.emit(written // (1024 * 1024))
+                # Raising here aborts the download, e.g. when another video has been clicked
+                token.raise_if_cancelled()
+
+            # Download next to the final file, so an interrupted download is never mistaken for a
+            # finished one
+            part_fname = f"{fname}.{id(token)}.part"
+            try:
+                download_stream(chosen_stream, part_fname, on_progress)
+            except BaseException:
+                if os.path.exists(part_fname):
+                    os.remove(part_fname)
+                raise
+            os.replace(part_fname, fname)
+
+        return video.watch_url, video_id, fname
+
+    def _video_loaded(self, result):
         self.loading.hide()
+        if result is None:
+            return
+
+        self.current_url, self.current_video, fname = result
+        self.set_video_source(fname)
+        self._update_export_button()
 
-        self.video_downloaded.emit(fname)
+    def _video_load_failed(self, error: Exception):
+        print(f"error downloading video: {error}")
+        self.loading.hide()
 
     @Slot()
     def set_video_source(self, fname: str):
@@ -263,14 +626,32 @@ Right-click to remove a bounding box"""
         self.video_window.play()
         self.video_window.pause()
 
+    @Slot()
+    def _download_started(self, size: int):
+        self.loading.setRange(0, size)
+        self.loading.setValue(0)
+
     @Slot()
     def _file_size_change(self, size: int):
         self.loading.setValue(size)
 
-    def load_video(self, yt: YouTube):
+    def load_video(self, url: str):
         self.loading.setRange(0, 0)
-        t = Thread(target=self._load_video, args=(yt,))
-        t.start()
+        self.loading.show()
+
+        # Opening another video abandons whatever download or detection is still in progress
+        self.task_scheduler.cancel("prelabel")
+        self.task_scheduler.cancel("proposals")
+        token = self.task_scheduler.restart("video")
+        self.task_scheduler.submit(
+            self._load_video,
+            url,
+            token,
+            token=token,
+            priority=Priority.HIGH,
+            on_result=self._video_loaded,
+            on_error=self._video_load_failed,
+        )
 
     def keyPressEvent(self, event: QKeyEvent) -> None:
         if event.text() == " ":
@@ -287,6 +668,14 @@ Right-click to remove a bounding box"""
         elif event.text() == ">":
             # Skip forward 30ms, or about one frame
             self.video_window.set_position(self.video_window.position + 15)
+        elif event.text() == "m":
+            self.mark_frame()
+        elif event.text() == "p":
+            self.propose_boxes()
+        elif event.text() == "[":
+            self.jump_to_prelabeled_frame(-1)
+        elif event.text() == "]":
+            self.jump_to_prelabeled_frame(1)
 
         return super().keyPressEvent(event)
 
@@ -367,13 +756,75 @@ class DrawableGraphicsScene(QGraphicsScene):
         self.rectangles = {}
         self.markers = {}
         self.click_point = None
+        # The box being drawn, until the mouse button is released
+        self.drawing_rect = None
         self.current_label = "?"
-        self.unique_color = None
         self.crosshairs_color = QColor(128, 128, 128, 128)
         self.crosshairs_h = QGraphicsLineItem(0, 0, 0, 0)
         self.crosshairs_h.setPen(self.crosshairs_color)
         self.crosshairs_v = QGraphicsLineItem(0, 0, 0, 0)
         self.crosshairs_v.setPen(self.crosshairs_color)
+        # Mouse moves can come much faster than the screen refreshes, so only the last position
+        # since the crosshairs were drawn is used
+        self.crosshairs_pos = None
+        self.crosshairs_timer = QTimer(self)
+        self.crosshairs_timer.setSingleShot(True)
+        self.crosshairs_timer.setInterval(CROSSHAIRS_INTERVAL_MS)
+        self.crosshairs_timer.timeout.connect(self._move_crosshairs)
+
+    def yolo_boxes(self, labels) -> List[YoloBox]:
+        """Boxes for the labels in `labels`, normalized to the video frame."""
+        frame = self.items()[-1].boundingRect()
+
+        boxes = []
+        for label in self.rectangles:
+            if label not in labels:
+                continue
+            label_id = labels.index(label)
+            for rect in self.rectangles[label]:
+                r = rect.rect().normalized()
+                boxes.append(
+                    (
+                        label_id,
+                        (r.center().x() - frame.x()) / frame.width(),
+                        (r.center().y() - frame.y()) / frame.height(),
+                        r.width() / frame.width(),
+                        r.height() / frame.height(),
+                    )
+                )
+        return boxes
+
+    def yolo_rect(self, x: float, y: float, w: float, h: float) -> QRectF:
+        """The scene rectangle of a box normalized to the video frame, the inverse of yolo_boxes."""
+        frame = self.items()[-1].boundingRect()
+        return QRectF(
+            frame.x() + (x - w / 2) * frame.width(),
+            frame.y() + (y - h / 2) * frame.height(),
+            w * frame.width(),
+            h * frame.height(),
+        )
+
+    def add_box(self, label: str, rect: QRectF) -> QGraphicsRectItem:
+        color = label_color(label)
+        rect = rect.normalized()
+
+        item = QGraphicsRectItem(rect)
+        item.setPen(color)
+        self.rectangles.setdefault(label, []).append(item)
+        self.addItem(item)
+
+        marker = QGraphicsTextItem(label)
+        marker.setDefaultTextColor(color)
+        marker.setPos(rect.x(), rect.y())
+        marker.setFont(QFont("Roboto", 3))
+        self.markers.setdefault(label, []).append(marker)
+        self.addItem(marker)
+        return item
+
+    def remove_box(self, label: str, item: QGraphicsRectItem) -> None:
+        i = self.rectangles[label].index(item)
+        self.removeItem(self.rectangles[label].pop(i))
+        self.removeItem(self.markers[label].pop(i))
 
     def mousePressEvent(self, event: QGraphicsSceneMouseEvent) -> None:
         if event.button() == Qt.LeftButton:
@@ -392,42 +843,20 @@ class DrawableGraphicsScene(QGraphicsScene):
                 return
 
             self.click_point = event.scenePos()
-            next_rect = QGraphicsRectItem(self.click_point.x(), self.click_point.y(), 0, 0)
-            r = sigmoid(hash(self.current_label) / (1 << 63)) * 255
-            g = sigmoid(hash(self.current_label[1:] + self.current_label[0]) / (1 << 63)) * 255
-            b = sigmoid(hash(self.current_label[2:] + self.current_label[0:2]) / (1 << 63)) * 255
-            brightness = math.sqrt(r * r + g * g + b * b)
-            self.unique_color = QColor(
-                r / brightness * 255,
-                g / brightness * 255,
-                b / brightness * 255,
-                255,
-            )
-            next_rect.setPen(self.unique_color)
-            if self.current_label not in self.rectangles or not self.rectangles[self.current_label]:
-                self.rectangles[self.current_label] = []
-            self.rectangles[self.current_label].append(next_rect)
-            self.addItem(self.rectangles[self.current_label][-1])
+            self.drawing_rect = QGraphicsRectItem(self.click_point.x(), self.click_point.y(), 0, 0)
+            self.drawing_rect.setPen(label_color(self.current_label))
+            self.addItem(self.drawing_rect)
 
         elif event.button() == Qt.RightButton:
+            x = event.scenePos().x()
+            y = event.scenePos().y()
             to_remove = []
             for label in self.rectangles:
-                for i, rect in enumerate(self.rectangles[label]):
-                    br = rect.boundingRect()
-                    x = event.scenePos().x()
-                    y = event.scenePos().y()
-                    l = min(br.x(), br.x() + br.width())
-                    r = max(br.x(), br.x() + br.width())
-                    t = min(br.y(), br.y() + br.height())
-                    b = max(br.y(), br.y() + br.height())
-                    if l < x < r and t < y < b:
-                        to_remove.append((label, i))
-            to_remove.reverse()
-            for (label, i) in to_remove:
-                self.removeItem(self.rectangles[label][i])
-                self.rectangles[label].pop(i)
-                self.removeItem(self.markers[label][i])
-                self.markers[label].pop(i)
+                for rect in self.rectangles[label]:
+                    if rect.rect().normalized().contains(x, y):
+                        to_remove.append((label, rect))
+            for label, rect in to_remove:
+                self.remove_box(label, rect)
 
         return super().mousePressEvent(event)
 
@@ -435,22 +864,14 @@ class DrawableGraphicsScene(QGraphicsScene):
         x = event.scenePos().x()
         y = event.scenePos().y()
 
-        # Draw crosshairs
-        self.crosshairs_h.setLine(0, y, self.width(), y)
-        self.crosshairs_v.setLine(x, 0, x, self.height())
-        if self.crosshairs_h not in self.items() or self.crosshairs_v not in self.items():
-            self.addItem(self.crosshairs_h)
-            self.addItem(self.crosshairs_v)
+        self.crosshairs_pos = (x, y)
+        if not self.crosshairs_timer.isActive():
+            self.crosshairs_timer.start()
 
         if self.click_point is not None:
-            width, height = (
-                self.items()[-1].boundingRect().width(),
-                self.items()[-1].boundingRect().height(),
-            )
-            x_offset, y_offset = (
-                self.items()[-1].boundingRect().x(),
-                self.items()[-1].boundingRect().y(),
-            )
+            frame = self.items()[-1].boundingRect()
+            width, height = frame.width(), frame.height()
+            x_offset, y_offset = frame.x(), frame.y()
 
             if x < x_offset:
                 x = x_offset
@@ -462,7 +883,7 @@ class DrawableGraphicsScene(QGraphicsScene):
             elif y > y_offset + height:
                 y = y_offset + height
 
-            self.rectangles[self.current_label][-1].setRect(
+            self.drawing_rect.setRect(
                 self.click_point.x(),
                 self.click_point.y(),
                 x - self.click_point.x(),
@@ -471,35 +892,26 @@ class DrawableGraphicsScene(QGraphicsScene):
 
         return super().mouseMoveEvent(event)
 
+    def _move_crosshairs(self):
+        x, y = self.crosshairs_pos
+        self.crosshairs_h.setLine(0, y, self.width(), y)
+        self.crosshairs_v.setLine(x, 0, x, self.height())
+        if self.crosshairs_h.scene() is None:
+            self.addItem(self.crosshairs_h)
+            self.addItem(self.crosshairs_v)
+
     def mouseReleaseEvent(self, event: QGraphicsSceneMouseEvent) -> None:
         if event.button() == Qt.LeftButton:
             if self.click_point is None:
                 return
+            self.removeItem(self.drawing_rect)
+            # Anything smaller is taken for a stray click
             if (
-                abs(event.scenePos().x() - self.click_point.x()) < 10
-                and abs(event.scenePos().y() - self.click_point.y()) < 10
+                abs(event.scenePos().x() - self.click_point.x()) >= 10
+                or abs(event.scenePos().y() - self.click_point.y()) >= 10
             ):
-                self.removeItem(self.rectangles[self.current_label][-1])
-                self.rectangles[self.current_label].pop(-1)
-            else:
-                if self.current_label not in self.markers or not self.markers[self.current_label]:
-                    self.markers[self.current_label] = []
-                top_left_x = min(
-                    self.rectangles[self.current_label][-1].rect().x(),
-                    self.rectangles[self.current_label][-1].rect().x()
-                    + self.rectangles[self.current_label][-1].rect().width(),
-                )
-                top_left_y = min(
-                    self.rectangles[self.current_label][-1].rect().y(),
-                    self.rectangles[self.current_label][-1].rect().y()
-                    + self.rectangles[self.current_label][-1].rect().height(),
-                )
-                text = QGraphicsTextItem(self.current_label)
-                self.markers[self.current_label].append(text)
-                self.markers[self.current_label][-1].setDefaultTextColor(self.unique_color)
-                self.markers[self.current_label][-1].setPos(top_left_x, top_left_y)
-                self.markers[self.current_label][-1].setFont(QFont("Roboto", 3))
-                self.addItem(self.markers[self.current_label][-1])
+                self.add_box(self.current_label, self.drawing_rect.rect())
+            self.drawing_rect = None
 
         self.click_point = None
 
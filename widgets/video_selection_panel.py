@@ -11,11 +11,11 @@ from widgets.thumbnail_gallery import ThumbnailGallery
 
 
 class VideoSelectionPanel(QWidget):
-    def __init__(self, yt8m_client, *args, **kwargs):
+    def __init__(self, yt8m_client, task_scheduler, manifest_cache, library, *args, **kwargs):
         QWidget.__init__(self, *args, **kwargs)
 
-        self.label_picker = LabelPicker(yt8m_client)
-        self.thumbnail_gallery = ThumbnailGallery()
+        self.label_picker = LabelPicker(yt8m_client, task_scheduler, library)
+        self.thumbnail_gallery = ThumbnailGallery(task_scheduler, manifest_cache, library)
         self.thumbnail_gallery.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
         self.thumbnail_scroll = VerticalScrollArea()
         self.thumbnail_scroll.setWidget(self.thumbnail_gallery)
@@ -26,6 +26,7 @@ class VideoSelectionPanel(QWidget):
 
         self.label_picker.fetching_urls.connect(self.load_tag)
         self.label_picker.urls_ready.connect(self.handle_new_urls)
+        self.label_picker.videos_ready.connect(self.thumbnail_gallery.add_local_videos)
         # Removed because it would load 4 or 5 times (stalling the ui) when the user scrolled to the bottom
         # self.thumbnail_scroll.reached_bottom.connect(self.label_picker.fetch_next_ten_urls_for_tag)
         self.thumbnail_gallery.thumbnails_ready.connect(self.label_picker.loading.hide)
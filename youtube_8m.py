@@ -1,8 +1,4 @@
-import requests
 import csv
-from concurrent.futures import ThreadPoolExecutor
-
-from requests.models import DEFAULT_REDIRECT_LIMIT
 
 
 class YouTube8mClient(object):
@@ -18,13 +14,43 @@ class YouTube8mClient(object):
     ID_TO_VIDEO_URL = "https://storage.googleapis.com/data.yt8m.org/2/j/i/"
     YOUTUBE_TEMPLATE_URL = "https://www.youtube.com/watch?v="
 
-    def __init__(self):
-        self.requests_session = requests.Session()
+    def __init__(self, manifest=None, tag_index_folder=None, task_scheduler=None):
+        # A manifest.VideoManifest to serve lookups from instead of the network, if it has them
+        self.manifest = manifest
+        # A task_scheduler.TaskScheduler with a "lookups" pool to look up video names in parallel
+        self.task_scheduler = task_scheduler
+        # Folder of a tag_index.TagIndex for multi-label queries, loaded on first use
+        self.tag_index_folder = tag_index_folder
+        self._tag_index = None
+        self._requests_session = None
         self.labels = []
         self.urls = []
         self.last_id_accessed = {}
 
+    @property
+    def requests_session(self):
+        # requests is slow to import, so it is loaded the first time the network is used
+        if self._requests_session is None:
+            import requests
+
+            self._requests_session = requests.Session()
+        return self._requests_session
+
+    @property
+    def tag_index(self):
+        if self._tag_index is None and self.tag_index_folder is not None:
+            from tag_index import TagIndex
+
+            self._tag_index = TagIndex.load(self.tag_index_folder)
+        return self._tag_index
+
     def fetch_labels(self):
+        if self.manifest is not None:
+            labels = self.manifest.labels()
+            if labels:
+                self.labels = labels
+                return labels
+
         try:
             r = self.requests_session.get(self.LABELS_CSV_URL)
         except ConnectionError:
@@ -41,10 +67,11 @@ class YouTube8mClient(object):
         self.labels = labels
         return labels
 
-    def fetch_next_ten_urls_for_tag(self, tag):
-        NUM_URLS_TO_FETCH = 10
-
+    def fetch_ids_for_tag(self, tag):
         tag = tag.replace("/m/", "")
+        if self.manifest is not None and self.manifest.has_tag(tag):
+            return self.manifest.tag_ids(tag)
+
         r = self.requests_session.get(f"{self.TAG_TO_LIST_URL}{tag}.js")
 
         # Remove javascript syntax
@@ -53,27 +80,67 @@ class YouTube8mClient(object):
         )
 
         # Values are comma-separated and start with the tag (which is redundant)
-        ids = [id for id in text.split(",") if id != tag]
+        return [id for id in text.split(",") if id != tag]
+
+    def fetch_next_ten_urls_for_tag(self, tag, token=None):
+        tag = tag.replace("/m/", "")
+        return self.fetch_next_ten_urls_for_ids(tag, self.fetch_ids_for_tag(tag), token)
+
+    def fetch_next_ten_urls_for_query(self, expression, token=None):
+        """Like fetch_next_ten_urls_for_tag, for the videos matching a tag_index query."""
+        ids = self.tag_index.query(expression, self.labels)
+        return self.fetch_next_ten_urls_for_ids(expression, ids, token)
 
-        if tag not in self.last_id_accessed:
-            self.last_id_accessed[tag] = 0
+    def fetch_next_ten_urls_for_ids(self, key, ids, token=None):
+        """The next ten videos from ids, continuing where the last call with the same key ended."""
+        NUM_URLS_TO_FETCH = 10
 
+        end = self.last_id_accessed.get(key, 0)
         urls = []
-        while len(urls) < NUM_URLS_TO_FETCH:
+        while len(urls) < NUM_URLS_TO_FETCH and end < len(ids):
             remaining = NUM_URLS_TO_FETCH - len(urls)
 
-            with ThreadPoolExecutor(max_workers=remaining) as p:
-                names = p.map(
-                    self.get_yt_link_from_id,
-                    ids[self.last_id_accessed[tag] : self.last_id_accessed[tag] + remaining],
-                )
-            names = [name for name in names if name]  # Remove empty
+            names = self.get_yt_links_from_ids(ids[end : end + remaining], token)
+            end += len(names)
 
-            self.last_id_accessed[tag] += len(names)
+            names = [name for name in names if name]  # Remove empty
             urls.extend([self.YOUTUBE_TEMPLATE_URL + name for name in names])
 
+        # Only advanced for a page that will be shown, so a cancelled one is fetched again
+        if token is not None:
+            token.raise_if_cancelled()
+        self.last_id_accessed[key] = end
         return urls
 
+    def get_yt_links_from_ids(self, ids, token=None):
+        """
+        get_yt_link_from_id() for every id, looking in the manifest first.  With a task scheduler
+        the lookups run in parallel on its "lookups" pool, otherwise one after the other.
+        """
+        if self.manifest is not None:
+            names = self.manifest.names(ids)
+        else:
+            names = [None] * len(ids)
+
+        missing = [id for id, name in zip(ids, names) if name is None]
+        if missing:
+            if self.task_scheduler is not None:
+                found = self.task_scheduler.map(
+                    self.get_yt_link_from_id, missing, token=token, pool="lookups"
+                )
+                found = dict(zip(missing, found))
+            else:
+                found = {}
+                for id in missing:
+                    if token is not None:
+                        token.raise_if_cancelled()
+                    found[id] = self.get_yt_link_from_id(id)
+            if self.manifest is not None:
+                self.manifest.put_names(found.items())
+            names = [found[id] if name is None else name for id, name in zip(ids, names)]
+
+        return names
+
     def get_yt_link_from_id(self, id):
         r = self.requests_session.get(f"{self.ID_TO_VIDEO_URL}{id[0:2]}/{id}.js", timeout=5)
         responses = r.text.replace("i(", "").replace(");", "").replace('"', "").split(",")